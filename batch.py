@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Batch changes to a user's items, applied in one transaction.
+#
+# A batch is a list of operations:
+#   {"op": "create", "room_id": 1, "name": "Lamp", "description": "", "price": "$ 10"}
+#   {"op": "update", "id": 5, "name": "Desk lamp"}   (any of name, description, price)
+#   {"op": "move", "id": 5, "room_id": 2}
+#   {"op": "delete", "id": 5}
+#
+# Every operation is validated first, with one ownership query for all the
+# items and one for all the rooms of the batch. Either all operations are
+# applied or, if one of them is invalid, none of them.
+
+from sqlalchemy import bindparam
+
+from database_setup import Room, Item, parse_price
+from importer import RowError, clean_field
+
+OPERATIONS = ("create", "update", "move", "delete")
+MAX_OPERATIONS = 1000 # operations accepted in one batch
+IN_CHUNK_SIZE = 500 # ids per IN (...) list, below SQLite's variable limit
+ITEM_FIELDS = ("name", "description", "price")
+
+
+def chunks(values, size = IN_CHUNK_SIZE):
+	values = list(values)
+	for i in range(0, len(values), size):
+		yield values[i:i + size]
+
+def owned_room_ids(session, user_id, room_ids):
+	# Return the subset of room_ids that belong to the user
+	owned = set()
+	for chunk in chunks(room_ids):
+		owned.update(row.id for row in session.query(Room.id).filter(
+			Room.id.in_(chunk), Room.user_id == user_id))
+	return owned
+
+def owned_item_ids(session, user_id, item_ids):
+	# Return the subset of item_ids that belong to rooms of the user
+	owned = set()
+	for chunk in chunks(item_ids):
+		owned.update(row.id for row in session.query(Item.id).join(Room, Room.id == Item.room_id).\
+			filter(Item.id.in_(chunk), Room.user_id == user_id))
+	return owned
+
+def parse_id(operation, field):
+	# Return an integer id field of an operation, or raise RowError
+	value = operation.get(field)
+	if isinstance(value, bool) or not isinstance(value, int):
+		raise RowError("{} must be an integer".format(field))
+	return value
+
+def item_values(operation, required):
+	# Return the checked item fields given in an operation. With required,
+	# name must be given and missing fields default to "".
+	values = {}
+	for field in ITEM_FIELDS:
+		if required or field in operation:
+			values[field] = clean_field(operation, field, required = required and field == "name")
+	if "name" in values and not values["name"]:
+		raise RowError("Missing name")
+	if "price" in values:
+		values['price_cents'], values['currency'] = parse_price(values['price'])
+	return values
+
+def validate_operations(session, user_id, operations):
+	# Return (cleaned operations, results). A result is None for a valid
+	# operation and {"error": ...} for an invalid one.
+	cleaned = []
+	results = []
+	seen_ids = set()
+
+	for operation in operations:
+		try:
+			if not isinstance(operation, dict):
+				raise RowError("Operation must be an object")
+			op = operation.get("op")
+			if op not in OPERATIONS:
+				raise RowError("op must be one of {}".format(", ".join(OPERATIONS)))
+
+			clean = {'op': op}
+			if op != "create":
+				clean['id'] = parse_id(operation, "id")
+				if clean['id'] in seen_ids:
+					raise RowError("Item {} appears more than once in the batch".format(clean['id']))
+				seen_ids.add(clean['id'])
+			if op in ("create", "move"):
+				clean['room_id'] = parse_id(operation, "room_id")
+			if op in ("create", "update"):
+				clean['values'] = item_values(operation, required = op == "create")
+				if not clean['values']:
+					raise RowError("Nothing to update")
+			cleaned.append(clean)
+			results.append(None)
+		except RowError as e:
+			cleaned.append(None)
+			results.append({'error': str(e)})
+
+	# Ownership of all rooms and items, checked with set-based queries
+	valid = [clean for clean in cleaned if clean is not None]
+	rooms = owned_room_ids(session, user_id, set(c['room_id'] for c in valid if 'room_id' in c))
+	items = owned_item_ids(session, user_id, set(c['id'] for c in valid if 'id' in c))
+	for i, clean in enumerate(cleaned):
+		if clean is None:
+			continue
+		if 'id' in clean and clean['id'] not in items:
+			results[i] = {'error': "No item found for item id: {}".format(clean['id'])}
+		elif 'room_id' in clean and clean['room_id'] not in rooms:
+			results[i] = {'error': "No room found for room id: {}".format(clean['room_id'])}
+
+	return cleaned, results
+
+def apply_operations(session, user_id, operations):
+	# Validate and apply a batch for the user with the given id, without
+	# committing. Return (applied, results) with one result per operation:
+	# {"op", "id", "status"} or {"op", "id", "status": "error", "error"}.
+	if len(operations) > MAX_OPERATIONS:
+		raise ValueError("A batch holds at most {} operations".format(MAX_OPERATIONS))
+
+	cleaned, results = validate_operations(session, user_id, operations)
+	applied = not any(results)
+
+	if applied:
+		item_table = Item.__table__
+		updates = {}
+		deletes = []
+		for i, clean in enumerate(cleaned):
+			if clean['op'] == "create":
+				values = dict(clean['values'], room_id = clean['room_id'], user_id = user_id)
+				clean['id'] = session.execute(item_table.insert().values(**values)).inserted_primary_key[0]
+			elif clean['op'] == "delete":
+				deletes.append(clean['id'])
+			else:
+				values = clean.get('values') or {'room_id': clean['room_id']}
+				# Updates setting the same columns are sent as one executemany
+				row = dict(("b_" + column, value) for column, value in values.items())
+				updates.setdefault(tuple(sorted(values)), []).append(dict(row, b_id = clean['id']))
+
+		for columns, rows in updates.items():
+			session.execute(item_table.update().where(item_table.c.id == bindparam('b_id')).\
+				values(dict((column, bindparam("b_" + column)) for column in columns)), rows)
+		for chunk in chunks(deletes):
+			session.query(Item).filter(Item.id.in_(chunk)).delete(synchronize_session = False)
+
+	for i, clean in enumerate(cleaned):
+		source = clean or (operations[i] if isinstance(operations[i], dict) else {})
+		result = {'op': source.get('op'), 'id': source.get('id')}
+		if results[i] is not None:
+			result.update(results[i], status = "error")
+		else:
+			result['status'] = "ok" if applied else "not applied"
+		results[i] = result
+	return applied, results
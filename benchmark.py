@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Load benchmark of the routes in main.py.
+#
+# For every data size a fresh SQLite database is generated, then each route
+# is requested through Flask's test client as a logged-in user. Latency
+# percentiles, throughput and SQL queries per request are printed and saved
+# as JSON, so that two runs can be compared for regressions.
+#
+# Usage:
+#   python benchmark.py [--sizes 10x10,20x100,50x500] [--iterations 50]
+#                       [--output bench_results.json] [--no-fragment-cache]
+#                       [--batch-size 100]
+#
+# Running once with and once without --no-fragment-cache shows the time
+# saved by the template fragment cache on the read-heavy pages. Editing and
+# deleting --batch-size items one by one is compared with /api/items/batch.
+
+from sqlalchemy import event, text
+
+from database_setup import Room, Item, setup_db
+from db import create_db_engine
+import generate_data
+from cache import NullCache
+from sessions import SQLStore
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# main.py reads client_secrets.json relative to the working directory
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+import main
+main.create_app({'WARM_UP': False, 'RATE_LIMITS': "", 'CONCURRENCY_LIMITS': "",
+	'RATE_LIMIT_STORE': "memory"})
+
+
+class QueryCounter(object):
+	# Count the SQL statements executed on an engine
+	def __init__(self, engine):
+		self.count = 0
+		event.listen(engine, "before_cursor_execute", self.on_execute)
+
+	def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+		self.count += 1
+
+
+def percentile(sorted_values, fraction):
+	# Return the value at the given fraction of an already sorted list
+	index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+	return sorted_values[index]
+
+def summarize(timings, queries):
+	# Return latency percentiles (ms), throughput and queries per request
+	timings = sorted(timings)
+	total = sum(timings)
+	return {
+		'requests'       : len(timings),
+		'p50_ms'         : round(percentile(timings, 0.50) * 1000, 3),
+		'p95_ms'         : round(percentile(timings, 0.95) * 1000, 3),
+		'p99_ms'         : round(percentile(timings, 0.99) * 1000, 3),
+		'throughput_rps' : round(len(timings) / total, 1) if total else None,
+		'queries'        : round(float(queries) / len(timings), 2),
+	}
+
+def parse_sizes(text):
+	# Parse "10x10,20x100" into [(10, 10), (20, 100)] (rooms x items per room)
+	return [tuple(int(n) for n in size.split("x")) for size in text.split(",")]
+
+
+class RouteBenchmark(object):
+	# Drives the routes of main.app against one generated database
+
+	def __init__(self, db_path, rooms, items, iterations, batch_size = 0):
+		self.iterations = iterations
+		self.batch_size = batch_size
+		self.items_per_room = items
+		self.engine = create_db_engine("sqlite:///" + db_path)
+		setup_db(self.engine)
+		email = generate_data.generate(self.engine, 1, rooms, items)[0]
+
+		with self.engine.connect() as connection:
+			self.user_id = connection.execute(text(
+				"SELECT id FROM user WHERE email = :email"), {'email': email}).scalar()
+			self.room_id = connection.execute(text(
+				"SELECT id FROM room WHERE user_id = :id ORDER BY id LIMIT 1"), {'id': self.user_id}).scalar()
+			self.item_id = connection.execute(text(
+				"SELECT id FROM item WHERE room_id = :id ORDER BY id LIMIT 1"), {'id': self.room_id}).scalar()
+
+		# Point the app at the generated database
+		main.session.remove()
+		main.session.configure(bind = self.engine)
+		main.rooms_cache.clear()
+		main.fragment_cache.clear()
+		self.counter = QueryCounter(self.engine)
+
+		if isinstance(getattr(main.app.session_interface, 'store', None), SQLStore):
+			main.app.session_interface.store = SQLStore(self.engine)
+		main.app.secret_key = "benchmark"
+		self.client = main.app.test_client()
+		with self.client.session_transaction() as login_session:
+			login_session['username'] = "Benchmark"
+			login_session['email'] = email
+			login_session['user_id'] = self.user_id
+
+	def new_item(self, room_id = None):
+		# Insert an item outside of the timed section and return its id
+		with self.engine.begin() as connection:
+			return connection.execute(Item.__table__.insert().values(name = "Temporary",
+				description = "", price = "$ 1", price_cents = 100, currency = "USD",
+				room_id = room_id or self.room_id,
+				user_id = self.user_id)).inserted_primary_key[0]
+
+	def new_room(self):
+		# Insert a full room outside of the timed section and return its id
+		with self.engine.begin() as connection:
+			room_id = connection.execute(Room.__table__.insert().values(
+				name = "Temporary", user_id = self.user_id)).inserted_primary_key[0]
+			if self.items_per_room:
+				connection.execute(Item.__table__.insert(), [{'name': "Temporary",
+					'description': "", 'price': "$ 1", 'price_cents': 100,
+					'currency': "USD", 'room_id': room_id,
+					'user_id': self.user_id} for i in range(self.items_per_room)])
+		return room_id
+
+	def requests(self):
+		# Yield (route name, setup, request) for every benchmarked route.
+		# setup runs untimed and returns the arguments passed to request.
+		room, item = self.room_id, self.item_id
+		get = self.client.get
+		post = self.client.post
+		item_form = {'name': "Benchmark", 'description': "Benchmark item", 'price': "$ 10"}
+
+		yield "allRooms", None, lambda: get("/rooms/")
+		yield "showItems", None, lambda: get("/room/{}/items/".format(room))
+		yield "showSingleItem", None, lambda: get("/room/{}/items/{}/".format(room, item))
+		yield "addItem", None, lambda: post("/room/{}/items/add/".format(room), data = item_form)
+		yield "editItem", None, lambda: post("/room/{}/items/{}/edit/".format(room, item), data = item_form)
+		yield "deleteItem", self.new_item, \
+			lambda item_id: get("/room/{}/items/{}/delete/?delete=true".format(room, item_id))
+		yield "deleteRoom", self.new_room, \
+			lambda room_id: get("/room/{}/delete/?delete=true".format(room_id))
+		yield "searchItems", None, lambda: get("/search/?q=lamp")
+		yield "JSON", None, lambda: get("/JSON")
+		yield "apiExport", None, lambda: get("/api/export").get_data()
+
+	def compare_batch(self, count):
+		# Return the time (ms) to edit and to delete count items through the
+		# per-item routes and through one call to /api/items/batch
+		room = self.room_id
+		item_form = {'name': "Benchmark", 'description': "Benchmark item", 'price': "$ 10"}
+		results = {}
+
+		def timed(send):
+			start = time.perf_counter()
+			for response in send():
+				if response.status_code >= 400:
+					raise RuntimeError("Batch comparison answered {}".format(response.status_code))
+			return (time.perf_counter() - start) * 1000
+
+		def batch(operations):
+			return [self.client.post("/api/items/batch", json = {'operations': operations})]
+
+		item_ids = [self.new_item() for i in range(count)]
+		per_item = timed(lambda: [self.client.post("/room/{}/items/{}/edit/".format(room, item_id),
+			data = item_form) for item_id in item_ids])
+		batched = timed(lambda: batch([dict(item_form, op = "update", id = item_id) for item_id in item_ids]))
+		results['edit'] = {'per_item_ms': round(per_item, 3), 'batch_ms': round(batched, 3)}
+
+		item_ids = [self.new_item() for i in range(count)]
+		per_item = timed(lambda: [self.client.get("/room/{}/items/{}/delete/?delete=true".format(room, item_id))
+			for item_id in item_ids])
+		item_ids = [self.new_item() for i in range(count)]
+		batched = timed(lambda: batch([{'op': "delete", 'id': item_id} for item_id in item_ids]))
+		results['delete'] = {'per_item_ms': round(per_item, 3), 'batch_ms': round(batched, 3)}
+
+		for result in results.values():
+			result['speedup'] = round(result['per_item_ms'] / result['batch_ms'], 1)
+		return results
+
+	def run(self):
+		# Return the summary of every route
+		results = {}
+		for name, setup, send in self.requests():
+			timings = []
+			queries = 0
+			for i in range(self.iterations):
+				args = (setup(),) if setup else ()
+				self.counter.count = 0
+				start = time.perf_counter()
+				response = send(*args)
+				timings.append(time.perf_counter() - start)
+				queries += self.counter.count
+				if getattr(response, "status_code", 200) >= 400:
+					raise RuntimeError("{} answered {}".format(name, response.status_code))
+			results[name] = summarize(timings, queries)
+		if self.batch_size:
+			results['batch'] = self.compare_batch(self.batch_size)
+		main.session.remove()
+		return results
+
+
+def print_results(size, results):
+	print("\n{} rooms x {} items per room".format(*size))
+	print("{:<16}{:>10}{:>10}{:>10}{:>12}{:>10}".format("route", "p50 ms", "p95 ms", "p99 ms", "req/s", "queries"))
+	for name, r in results.items():
+		if name == "batch":
+			continue
+		print("{:<16}{:>10}{:>10}{:>10}{:>12}{:>10}".format(name, r['p50_ms'], r['p95_ms'],
+			r['p99_ms'], r['throughput_rps'], r['queries']))
+	for action, r in results.get('batch', {}).items():
+		print("{} items: {} ms one by one, {} ms in one batch ({}x faster)".format(action,
+			r['per_item_ms'], r['batch_ms'], r['speedup']))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Benchmark the routes of main.py")
+	parser.add_argument("--sizes", default = "10x10,20x100,50x500", help = "comma-separated ROOMSxITEMS data sizes")
+	parser.add_argument("--iterations", type = int, default = 50, help = "requests per route and size")
+	parser.add_argument("--output", default = "bench_results.json", help = "file to save results to")
+	parser.add_argument("--no-fragment-cache", action = "store_true", help = "render every fragment")
+	parser.add_argument("--batch-size", type = int, default = 100, help = "items edited and deleted "
+		"per-item and through /api/items/batch for comparison (0 to skip)")
+	args = parser.parse_args()
+
+	if args.no_fragment_cache:
+		main.fragment_cache = NullCache()
+
+	report = {'iterations': args.iterations, 'fragment_cache': not args.no_fragment_cache, 'sizes': {}}
+	directory = tempfile.mkdtemp()
+	try:
+		for size in parse_sizes(args.sizes):
+			db_path = os.path.join(directory, "bench_{}x{}.db".format(*size))
+			results = RouteBenchmark(db_path, size[0], size[1], args.iterations, args.batch_size).run()
+			report['sizes']["{}x{}".format(*size)] = results
+			print_results(size, results)
+	finally:
+		shutil.rmtree(directory)
+
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent = 2)
+	print("\nResults saved to {}".format(args.output))
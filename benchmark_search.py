@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Compare item search through the FTS5 index with LIKE '%q%' scans.
+#
+# The generated database holds several users. Search terms with a known
+# selectivity (a share of the items) are added to the item descriptions,
+# next to a word of the generator's small vocabulary, which matches a large
+# share of the items. For each term, searched by one user, it prints how
+# many of the user's items match and the time (ms) of:
+#   FTS5 top 20   the query of /search/: the 20 best matches by bm25, with
+#                 the user matched inside the index
+#   FTS5 via room the former query, keeping the user's rows after MATCH
+#   FTS5 all      every match of the user, from the index
+#   LIKE all      every match of the user, by scanning the user's items
+# Ranking needs every match, so "FTS5 all" against "LIKE all" is the
+# like-for-like comparison of the two ways to find the matches.
+#
+# Usage:
+#   python benchmark_search.py [--items 100000] [--users 10] [--iterations 20]
+
+from sqlalchemy import text
+
+from database_setup import Base, create_search_index
+from db import create_db_engine
+from main import SEARCH_SQL, search_query
+import generate_data
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+ROOMS = 50 # rooms per user
+OWNER_ID = 1 # the user searching
+
+# Search terms added to the descriptions of one item in every n
+TERMS = (("zqrare", 1000), ("zqfew", 100), ("zqsome", 10))
+VOCABULARY_WORD = "lamp"
+
+ROOM_QUERY = text("""
+	SELECT item.id FROM item_fts
+	JOIN item ON item.id = item_fts.rowid
+	JOIN room ON room.id = item.room_id
+	WHERE item_fts MATCH :match AND room.user_id = :owner_id
+	ORDER BY bm25(item_fts) LIMIT 20""")
+
+FTS_ALL_QUERY = text("SELECT rowid FROM item_fts WHERE item_fts MATCH :match")
+
+LIKE_ALL_QUERY = text("""
+	SELECT id FROM item
+	WHERE user_id = :owner_id AND (name LIKE :like OR description LIKE :like)""")
+
+
+def time_query(connection, query, params, iterations):
+	# Return (average time in ms, rows) of a query
+	start = time.perf_counter()
+	for i in range(iterations):
+		rows = connection.execute(query, params).fetchall()
+	return (time.perf_counter() - start) * 1000 / iterations, len(rows)
+
+def add_terms(connection):
+	# Append every term to the description of one item in n (the triggers
+	# update the search index)
+	for offset, (term, n) in enumerate(TERMS):
+		connection.execute(text(
+			"UPDATE item SET description = description || ' ' || :term WHERE id % :n = :offset"),
+			{'term': term, 'n': n, 'offset': offset})
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Benchmark FTS5 search against LIKE")
+	parser.add_argument("--items", type = int, default = 100000, help = "number of items of all users")
+	parser.add_argument("--users", type = int, default = 10, help = "number of users")
+	parser.add_argument("--iterations", type = int, default = 20, help = "runs per query")
+	args = parser.parse_args()
+
+	directory = tempfile.mkdtemp()
+	try:
+		engine = create_db_engine("sqlite:///" + os.path.join(directory, "search.db"))
+		Base.metadata.create_all(engine)
+		create_search_index(engine)
+		generate_data.generate(engine, args.users, ROOMS, args.items // (args.users * ROOMS))
+		with engine.begin() as connection:
+			add_terms(connection)
+
+		print("{} items of {} users, searched by one user".format(args.items, args.users))
+		print("{:<10}{:>9}{:>15}{:>15}{:>11}{:>11}".format(
+			"term", "matches", "FTS5 top 20", "FTS5 via room", "FTS5 all", "LIKE all"))
+		with engine.connect() as connection:
+			for term in [VOCABULARY_WORD] + [term for term, n in TERMS]:
+				match = search_query(OWNER_ID, term)
+				top = time_query(connection, SEARCH_SQL,
+					{'match': match, 'limit': 20, 'offset': 0}, args.iterations)[0]
+				via_room = time_query(connection, ROOM_QUERY,
+					{'match': '"{}"*'.format(term), 'owner_id': OWNER_ID}, args.iterations)[0]
+				fts_all, matches = time_query(connection, FTS_ALL_QUERY,
+					{'match': match}, args.iterations)
+				like_all = time_query(connection, LIKE_ALL_QUERY,
+					{'owner_id': OWNER_ID, 'like': "%{}%".format(term)}, args.iterations)[0]
+				print("{:<10}{:>9}{:>15.3f}{:>15.3f}{:>11.3f}{:>11.3f}".format(
+					term, matches, top, via_room, fts_all, like_all))
+	finally:
+		shutil.rmtree(directory)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Compare the /JSON export built by serialization.py with the former path:
+# ORM objects, their serialize properties and json.dumps with jsonify's
+# settings. CPU time and payload size are printed for every data size.
+#
+# Usage:
+#   python benchmark_serialization.py [--sizes 10000,100000] [--iterations 3]
+
+from sqlalchemy.orm import sessionmaker, joinedload
+
+from database_setup import Room, Item, setup_db
+from db import create_db_engine
+import generate_data
+import serialization
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+ROOMS = 100 # rooms the items are spread over
+
+
+def orm_export(session, owner_id):
+	# The former /JSON path: ORM objects and their serialize properties
+	session.expunge_all()
+	rooms = session.query(Room).options(joinedload(Room.user)).\
+		filter_by(user_id = owner_id).order_by(Room.id).all()
+	items = session.query(Item).options(joinedload(Item.user)).\
+		join(Room, Item.room_id == Room.id).\
+		filter(Room.user_id == owner_id).order_by(Item.id).all()
+	rooms_by_id = {}
+	rooms_list = []
+	for room in rooms:
+		room_dictionary = room.serialize
+		room_dictionary["items"] = []
+		rooms_by_id[room.id] = room_dictionary
+		rooms_list.append(room_dictionary)
+	for item in items:
+		rooms_by_id[item.room_id]["items"].append(item.serialize)
+	# jsonify sorts keys and uses compact separators outside of debug mode
+	return json.dumps({'Rooms': rooms_list}, sort_keys = True, separators = (",", ":")).encode("utf-8")
+
+def stdlib_dumps(obj):
+	return json.dumps(obj, ensure_ascii = False, separators = (",", ":")).encode("utf-8")
+
+def measure(export, iterations):
+	# Return (CPU ms per export, payload bytes)
+	start = time.process_time()
+	for i in range(iterations):
+		payload = export()
+	return (time.process_time() - start) * 1000 / iterations, len(payload)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Benchmark the /JSON serialization")
+	parser.add_argument("--sizes", default = "10000,100000", help = "comma-separated item counts")
+	parser.add_argument("--iterations", type = int, default = 3, help = "exports per path and size")
+	args = parser.parse_args()
+
+	directory = tempfile.mkdtemp()
+	try:
+		for size in [int(n) for n in args.sizes.split(",")]:
+			engine = create_db_engine("sqlite:///" + os.path.join(directory, "export_{}.db".format(size)))
+			setup_db(engine)
+			generate_data.generate(engine, 1, ROOMS, size // ROOMS)
+			session = sessionmaker(bind = engine)()
+			connection = session.connection()
+			owner_id = 1
+
+			paths = [("ORM + serialize + json", lambda: orm_export(session, owner_id))]
+			for layout in serialization.LAYOUTS:
+				paths.append(("rows {} + json".format(layout), lambda layout = layout:
+					stdlib_dumps(serialization.export_rooms(connection, owner_id, layout))))
+				if serialization.orjson is not None:
+					paths.append(("rows {} + orjson".format(layout), lambda layout = layout:
+						serialization.dumps(serialization.export_rooms(connection, owner_id, layout))))
+
+			print("\n{} items".format(size))
+			print("{:<28}{:>12}{:>14}".format("path", "CPU ms", "bytes"))
+			for name, export in paths:
+				cpu_ms, size_bytes = measure(export, args.iterations)
+				print("{:<28}{:>12.1f}{:>14}".format(name, cpu_ms, size_bytes))
+			session.close()
+	finally:
+		shutil.rmtree(directory)
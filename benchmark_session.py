@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Compare the session backends of sessions.py with Flask's signed cookie.
+#
+# A logged-in login_session as written by /gconnect (including the JSON of
+# the OAuth credentials) is stored with every backend. The size of the
+# Cookie request header and the time to open and save the session, i.e. the
+# per-request session overhead, are printed.
+#
+# Usage:
+#   python benchmark_session.py [--iterations 2000]
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from database_setup import setup_db
+from db import create_db_engine
+from sessions import ServerSessionInterface, SQLStore, MemoryStore
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def login_session_data():
+	# Return a session with the shape and size of a Google login
+	id_token = {'iss': "accounts.google.com", 'azp': "x" * 72, 'aud': "x" * 72,
+		'sub': "1" * 21, 'email': "benchmark@example.com", 'email_verified': True,
+		'at_hash': "x" * 22, 'iat': 1500000000, 'exp': 1500003600}
+	jwt = "x" * 1100
+	credentials = {'access_token': "x" * 129, 'client_id': "x" * 72, 'client_secret': "x" * 24,
+		'refresh_token': None, 'token_expiry': "2017-07-14T03:00:00Z",
+		'token_uri': "https://accounts.google.com/o/oauth2/token", 'user_agent': None,
+		'revoke_uri': "https://accounts.google.com/o/oauth2/revoke", 'id_token': id_token,
+		'id_token_jwt': jwt, 'token_response': {'access_token': "x" * 129, 'expires_in': 3600,
+		'id_token': jwt, 'token_type': "Bearer"}, 'scopes': ["email", "profile"],
+		'token_info_uri': "https://www.googleapis.com/oauth2/v3/tokeninfo", 'invalid': False,
+		'_class': "OAuth2Credentials", '_module': "oauth2client.client"}
+	return {'state': "x" * 32, 'credentials': json.dumps(credentials), 'gplus_id': "1" * 21,
+		'provider': "google", 'username': "Benchmark User", 'email': "benchmark@example.com",
+		'picture': "https://lh3.googleusercontent.com/" + "x" * 80 + "/photo.jpg", 'user_id': 1}
+
+def measure(app, interface, iterations):
+	# Return (Cookie header bytes, ms per open + save of the session)
+	with app.test_request_context() as context:
+		login_session = interface.open_session(app, context.request)
+		login_session.update(login_session_data())
+		response = app.response_class()
+		interface.save_session(app, login_session, response)
+	cookie = response.headers['Set-Cookie'].split(";")[0]
+
+	start = time.perf_counter()
+	for i in range(iterations):
+		with app.test_request_context(headers = {'Cookie': cookie}) as context:
+			login_session = interface.open_session(app, context.request)
+			login_session.get('user_id')
+			interface.save_session(app, login_session, app.response_class())
+	return len(cookie), (time.perf_counter() - start) * 1000 / iterations
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Benchmark the session backends")
+	parser.add_argument("--iterations", type = int, default = 2000, help = "requests per backend")
+	args = parser.parse_args()
+
+	app = Flask(__name__)
+	app.secret_key = "benchmark"
+	directory = tempfile.mkdtemp()
+	try:
+		engine = create_db_engine("sqlite:///" + os.path.join(directory, "session.db"))
+		setup_db(engine)
+		backends = (("cookie", SecureCookieSessionInterface()),
+			("memory", ServerSessionInterface(MemoryStore())),
+			("sql", ServerSessionInterface(SQLStore(engine))))
+
+		print("{:<10}{:>16}{:>16}".format("backend", "cookie bytes", "ms/request"))
+		for name, interface in backends:
+			size, ms = measure(app, interface, args.iterations)
+			print("{:<10}{:>16}{:>16.4f}".format(name, size, ms))
+	finally:
+		shutil.rmtree(directory)
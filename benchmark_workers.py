@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Throughput of the app served by gunicorn with a growing number of workers.
+#
+# A database is generated once, then for every worker count gunicorn is
+# started on it (gunicorn.conf.py, wsgi:app) and a pool of client threads
+# requests the main pages as a logged-in user for a fixed duration.
+# Requests per second and latency percentiles are printed and saved as JSON.
+#
+# Usage:
+#   python benchmark_workers.py [--workers 1,2,4,8] [--threads 4]
+#                               [--clients 32] [--duration 20]
+#                               [--size 20x100] [--output bench_workers.json]
+
+from sqlalchemy import text
+
+from database_setup import setup_db
+from db import create_db_engine
+from sessions import ServerSessionInterface, SQLStore
+from profiling import percentile
+import generate_data
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import requests
+import secrets
+import shutil
+import subprocess
+import tempfile
+import time
+
+PORT = 5099
+
+
+def login(engine, email):
+	# Store a logged-in server-side session and return its id
+	with engine.connect() as connection:
+		user_id = connection.execute(text(
+			"SELECT id FROM user WHERE email = :email"), {'email': email}).scalar()
+		room_id = connection.execute(text(
+			"SELECT id FROM room WHERE user_id = :id ORDER BY id LIMIT 1"), {'id': user_id}).scalar()
+	sid = secrets.token_urlsafe(32)
+	data = ServerSessionInterface.serializer.dumps({'username': "Benchmark",
+		'email': email, 'user_id': user_id})
+	SQLStore(engine).save(sid, data, datetime.utcnow() + timedelta(days = 1))
+	return sid, room_id
+
+def start_server(db_path, workers, threads):
+	# Start gunicorn and wait until /health answers 200
+	env = dict(os.environ, DATABASE_URL = "sqlite:///" + db_path, SESSION_BACKEND = "sql",
+		RATE_LIMITS = "", CONCURRENCY_LIMITS = "", RATE_LIMIT_STORE = "memory",
+		WEB_CONCURRENCY = str(workers), THREADS = str(threads), BIND = "127.0.0.1:{}".format(PORT))
+	server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null",
+		"wsgi:app"], env = env)
+	for i in range(300):
+		try:
+			if requests.get("http://127.0.0.1:{}/health".format(PORT), timeout = 1).status_code == 200:
+				return server
+		except requests.ConnectionError:
+			pass
+		time.sleep(0.1)
+	server.terminate()
+	raise RuntimeError("gunicorn did not become ready")
+
+def run_load(paths, sid, clients, duration):
+	# Request paths round-robin from clients threads for duration seconds.
+	# Return the summary of all requests.
+	deadline = time.perf_counter() + duration
+
+	def client(n):
+		http = requests.Session()
+		http.cookies.set("session", sid)
+		timings = []
+		errors = 0
+		while time.perf_counter() < deadline:
+			start = time.perf_counter()
+			response = http.get("http://127.0.0.1:{}{}".format(PORT, paths[(n + len(timings)) % len(paths)]))
+			timings.append((time.perf_counter() - start) * 1000)
+			errors += response.status_code >= 400
+		return timings, errors
+
+	with ThreadPoolExecutor(clients) as pool:
+		results = list(pool.map(client, range(clients)))
+	timings = sorted(t for result in results for t in result[0])
+	return {
+		'requests'       : len(timings),
+		'errors'         : sum(result[1] for result in results),
+		'throughput_rps' : round(len(timings) / duration, 1),
+		'p50_ms'         : percentile(timings, 0.50),
+		'p95_ms'         : percentile(timings, 0.95),
+		'p99_ms'         : percentile(timings, 0.99),
+	}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Benchmark gunicorn with 1 to n workers")
+	parser.add_argument("--workers", default = "1,2,4,8", help = "comma-separated worker counts")
+	parser.add_argument("--threads", type = int, default = 4, help = "threads per worker")
+	parser.add_argument("--clients", type = int, default = 32, help = "concurrent client threads")
+	parser.add_argument("--duration", type = float, default = 20, help = "seconds per worker count")
+	parser.add_argument("--size", default = "20x100", help = "ROOMSxITEMS data size")
+	parser.add_argument("--output", default = "bench_workers.json", help = "file to save results to")
+	args = parser.parse_args()
+
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	rooms, items = (int(n) for n in args.size.split("x"))
+	report = {'threads': args.threads, 'clients': args.clients, 'size': args.size, 'workers': {}}
+	directory = tempfile.mkdtemp()
+	try:
+		db_path = os.path.join(directory, "workers.db")
+		engine = create_db_engine("sqlite:///" + db_path)
+		setup_db(engine)
+		sid, room_id = login(engine, generate_data.generate(engine, 1, rooms, items)[0])
+		paths = ["/rooms/", "/room/{}/items/".format(room_id), "/JSON"]
+
+		print("{:<10}{:>10}{:>10}{:>10}{:>10}{:>10}".format("workers", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"))
+		for workers in [int(n) for n in args.workers.split(",")]:
+			server = start_server(db_path, workers, args.threads)
+			try:
+				r = run_load(paths, sid, args.clients, args.duration)
+			finally:
+				server.terminate()
+				server.wait()
+			report['workers'][workers] = r
+			print("{:<10}{:>10}{:>10}{:>10}{:>10}{:>10}".format(workers, r['throughput_rps'],
+				r['p50_ms'], r['p95_ms'], r['p99_ms'], r['errors']))
+	finally:
+		shutil.rmtree(directory)
+
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent = 2)
+	print("\nResults saved to {}".format(args.output))
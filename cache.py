@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Small in-process caches shared by the routes in main.py
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class Cache(object):
+	# Common interface of all cache backends.
+	# Subclasses implement _get, _set, _delete and _clear; hit/miss counting
+	# is done here so every backend reports the same statistics.
+
+	def __init__(self):
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		# Return the cached value, or None on a miss
+		value = self._get(key)
+		if value is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return value
+
+	def set(self, key, value, ttl = None):
+		# ttl overrides the backend's default time-to-live for this entry
+		self._set(key, value, ttl)
+
+	def delete(self, key):
+		self._delete(key)
+
+	def clear(self):
+		self._clear()
+
+	def get_or_set(self, key, compute):
+		# Return the cached value, computing and storing it on a miss
+		value = self.get(key)
+		if value is None:
+			value = compute()
+			self.set(key, value)
+		return value
+
+	def stats(self):
+		# Return hit/miss counters in a JSON-friendly format
+		total = self.hits + self.misses
+		return {
+			'hits'     : self.hits,
+			'misses'   : self.misses,
+			'hit_rate' : float(self.hits) / total if total else 0.0,
+		}
+
+
+class NullCache(Cache):
+	# Backend that stores nothing, for switching caching off
+
+	def _get(self, key):
+		return None
+
+	def _set(self, key, value, ttl):
+		pass
+
+	def _delete(self, key):
+		pass
+
+	def _clear(self):
+		pass
+
+
+class LRUCache(Cache):
+	# In-process dictionary with bounded size and time-to-live.
+	# The least recently used entry is evicted when max_size is reached,
+	# and entries older than ttl seconds are treated as misses.
+
+	def __init__(self, max_size = 1024, ttl = 300):
+		Cache.__init__(self)
+		self.max_size = max_size
+		self.ttl = ttl
+		self._data = OrderedDict()
+		self._lock = Lock()
+
+	def _get(self, key):
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is None:
+				return None
+			expires, value = entry
+			if expires < time.time():
+				del self._data[key]
+				return None
+			self._data.move_to_end(key)
+			return value
+
+	def _set(self, key, value, ttl):
+		if ttl is None:
+			ttl = self.ttl
+		with self._lock:
+			self._data[key] = (time.time() + ttl, value)
+			self._data.move_to_end(key)
+			while len(self._data) > self.max_size:
+				self._data.popitem(last = False)
+
+	def _delete(self, key):
+		with self._lock:
+			self._data.pop(key, None)
+
+	def _clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self):
+		return len(self._data)
+
+	def stats(self):
+		result = Cache.stats(self)
+		result['size'] = len(self)
+		return result
+
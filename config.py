@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Application settings and OAuth client secrets.
+#
+# Settings have the defaults below and can be overridden by environment
+# variables of the same name, or by a Python settings file whose path is in
+# the APP_SETTINGS environment variable (loaded with app.config.from_envvar).
+
+from oauth2client.client import OAuth2WebServerFlow
+
+from threading import Lock
+import json
+import os
+import signal
+import time
+
+
+def env(name, default, convert = str):
+	# Return an environment variable converted to the type of its setting
+	value = os.environ.get(name)
+	if value is None:
+		return default
+	if convert is bool:
+		return value.lower() in ("1", "true", "yes", "on")
+	return convert(value)
+
+
+class Config(object):
+	# Flask (SECRET_KEY, DEBUG) and application settings
+	SECRET_KEY = env('SECRET_KEY', 'super_secret_key') # change it in production!
+	DEBUG = env('DEBUG', False, bool)
+	HOST = env('HOST', '0.0.0.0')
+	PORT = env('PORT', 5000, int)
+
+	DATABASE_URL = env('DATABASE_URL', 'sqlite:///room_item_user.db')
+	DB_POOL_SIZE = env('DB_POOL_SIZE', 10, int) # connections kept open in the pool
+	DB_MAX_OVERFLOW = env('DB_MAX_OVERFLOW', 20, int) # extra connections allowed under bursts
+	DB_BUSY_TIMEOUT = env('DB_BUSY_TIMEOUT', 30, int) # seconds a writer waits for the database lock
+	DB_POOL_RECYCLE = env('DB_POOL_RECYCLE', 3600, int) # seconds before a connection is replaced (-1: never)
+	DB_POOL_PRE_PING = env('DB_POOL_PRE_PING', False, bool) # test connections before using them
+	DB_SQLITE_SYNCHRONOUS = env('DB_SQLITE_SYNCHRONOUS', 'NORMAL')
+	DB_SQLITE_MMAP_SIZE = env('DB_SQLITE_MMAP_SIZE', 268435456, int) # bytes of the file memory-mapped
+	DB_SQLITE_CACHE_SIZE = env('DB_SQLITE_CACHE_SIZE', -65536, int) # pages, or KiB if negative
+
+	# Read-only copy of the database serving GET requests (see db.py)
+	DATABASE_REPLICA_URL = env('DATABASE_REPLICA_URL', None)
+
+	CLIENT_SECRETS_FILE = env('CLIENT_SECRETS_FILE', 'client_secrets.json')
+
+	# Where login_session is kept (see sessions.py): "sql" (web_session
+	# table), "memory" (single process only) or "cookie" (Flask's signed cookie)
+	SESSION_BACKEND = env('SESSION_BACKEND', 'sql')
+
+	# Token-bucket rate limits per endpoint and user (or IP address if not
+	# logged in), "*" applying to the other endpoints, and the number of
+	# requests of an endpoint allowed to run at once in a worker (see
+	# ratelimit.py). Buckets are kept in RATE_LIMIT_STORE: "memory" (per
+	# process) or the URL of a database shared by the workers. Behind a
+	# reverse proxy every anonymous client has the proxy's address, so e.g.
+	# gconnect=10/minute would allow 10 logins a minute to the whole site:
+	# set TRUSTED_PROXY_HOPS there.
+	RATE_LIMITS = env('RATE_LIMITS', ";".join([
+		"*=600/minute", "gconnect=10/minute", "JSON=30/minute", "apiExport=10/minute",
+		"apiImport=10/minute", "apiItemsBatch=60/minute", "searchItems=120/minute",
+		"apiSearch=120/minute", "addRoom=60/minute", "editRoom=60/minute",
+		"deleteRoom=60/minute", "addItem=120/minute", "editItem=120/minute",
+		"deleteItem=120/minute"]))
+	CONCURRENCY_LIMITS = env('CONCURRENCY_LIMITS',
+		"JSON=4;apiExport=2;apiImport=1;searchItems=8;apiSearch=8")
+	RATE_LIMIT_STORE = env('RATE_LIMIT_STORE', 'sqlite:///rate_limits.db')
+
+	# Number of reverse proxies in front of the app whose X-Forwarded-For and
+	# X-Forwarded-Proto headers are trusted (werkzeug's ProxyFix), so that
+	# request.remote_addr is the client's address. Leave it at 0 when clients
+	# reach the app directly: they could then forge their address.
+	TRUSTED_PROXY_HOPS = env('TRUSTED_PROXY_HOPS', 0, int)
+
+	# Warm-up of create_app(): templates are compiled and the room lists of
+	# the WARM_UP_USERS most recently active users are cached
+	WARM_UP = env('WARM_UP', True, bool)
+	WARM_UP_USERS = env('WARM_UP_USERS', 100, int)
+
+	# Request profiling (see profiling.py); statements slower than
+	# SLOW_QUERY_MS milliseconds are logged
+	PROFILING = env('PROFILING', False, bool)
+	SLOW_QUERY_MS = env('SLOW_QUERY_MS', 100.0, float)
+
+	# /_debug/stats shows SQL statements and per-endpoint traffic. It is only
+	# served with PROFILING and DEBUG or DEBUG_STATS on, to clients sending
+	# DEBUG_STATS_TOKEN in an X-Debug-Token header or, if no token is set,
+	# to clients on the loopback interface. Behind a proxy on the same host
+	# every client looks local unless TRUSTED_PROXY_HOPS is set, so set a
+	# token there.
+	DEBUG_STATS = env('DEBUG_STATS', False, bool)
+	DEBUG_STATS_TOKEN = env('DEBUG_STATS_TOKEN', None)
+
+
+class ClientSecrets(object):
+	# The web client secrets of a client_secrets.json file, read once and
+	# validated. The file is read again when its modification time changes
+	# (checked at most every check_interval seconds) or on SIGHUP.
+
+	REQUIRED_KEYS = ('client_id', 'client_secret', 'auth_uri', 'token_uri')
+
+	def __init__(self, path, check_interval = 5):
+		self.path = path
+		self.check_interval = check_interval
+		self._lock = Lock()
+		self._mtime = None
+		self._checked = 0
+		self.load()
+
+	def load(self):
+		# Read and validate the file; raise ValueError if it is invalid
+		mtime = os.stat(self.path).st_mtime
+		with open(self.path, 'r') as f:
+			secrets = json.load(f).get('web')
+		if not isinstance(secrets, dict):
+			raise ValueError("{} has no 'web' client section".format(self.path))
+		missing = [key for key in self.REQUIRED_KEYS if not secrets.get(key)]
+		if missing:
+			raise ValueError("{} is missing: {}".format(self.path, ", ".join(missing)))
+
+		flow = OAuth2WebServerFlow(client_id = secrets['client_id'],
+			client_secret = secrets['client_secret'], scope = '',
+			redirect_uri = 'postmessage', auth_uri = secrets['auth_uri'],
+			token_uri = secrets['token_uri'], revoke_uri = secrets.get('revoke_uri'))
+
+		with self._lock:
+			self._secrets = secrets
+			self._flow = flow
+			self._mtime = mtime
+			self._checked = time.time()
+
+	def reload_if_changed(self):
+		# Reload the file if it changed; keep the current secrets on error
+		now = time.time()
+		if now - self._checked < self.check_interval:
+			return
+		self._checked = now
+		try:
+			if os.stat(self.path).st_mtime != self._mtime:
+				self.load()
+		except (OSError, ValueError) as e:
+			print("Keeping current client secrets: {}".format(e))
+
+	def watch_signal(self, signum = getattr(signal, 'SIGHUP', None)):
+		# Reload the file when the process receives signum (main thread only)
+		if signum is not None:
+			signal.signal(signum, lambda signum, frame: self.load())
+
+	@property
+	def client_id(self):
+		self.reload_if_changed()
+		return self._secrets['client_id']
+
+	def get_flow(self):
+		# Return the OAuth flow for the "postmessage" sign-in of login.html.
+		# Exchanging a code does not change the flow, so it is shared.
+		self.reload_if_changed()
+		return self._flow
@@ -2,21 +2,51 @@
 
 # Create database
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, Text, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy.orm import relationship, validates
+from sqlalchemy import inspect, text, func
+from db import create_db_engine
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from os import remove
+import re
+import sys
 
 Base = declarative_base()
 
+CURRENCY_SYMBOLS = {'$': 'USD', u'\u20ac': 'EUR', u'\u00a3': 'GBP', u'\u00a5': 'JPY'}
+DEFAULT_CURRENCY = 'USD'
+
+def parse_price(price):
+  """Return (cents, currency) for a price such as "$ 1000" or "12.50 EUR",
+  or (None, None) if it holds no number"""
+  match = re.search(r"\d[\d,]*(\.\d+)?", price or "")
+  if not match:
+    return None, None
+  amount = Decimal(match.group().replace(",", ""))
+  cents = int((amount * 100).quantize(Decimal(1), rounding = ROUND_HALF_UP))
+
+  currency = DEFAULT_CURRENCY
+  code = re.search(r"\b[A-Za-z]{3}\b", price)
+  if code:
+    currency = code.group().upper()
+  else:
+    for symbol in CURRENCY_SYMBOLS:
+      if symbol in price:
+        currency = CURRENCY_SYMBOLS[symbol]
+  return cents, currency
+
 class User(Base):
   __tablename__ = 'user'
 
   id = Column(Integer, primary_key = True)
   name = Column(String(250), nullable = False)
-  email = Column(String(50), nullable = False)
+  email = Column(String(50), nullable = False, unique = True, index = True)
   picture = Column(String(250))
+  # Bumped by every change to the user's rooms and items
+  revision = Column(Integer, nullable = False, default = 0)
+  updated_at = Column(DateTime, default = datetime.utcnow)
 
   @property
   def serialize(self):
@@ -32,8 +62,9 @@ class Room(Base):
 
     id = Column(Integer, primary_key = True)
     name = Column(String(250), nullable = False)
+    updated_at = Column(DateTime, default = datetime.utcnow, onupdate = datetime.utcnow)
 
-    user_id = Column(Integer, ForeignKey('user.id'), nullable = False)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable = False, index = True)
     user = relationship(User)
 
     @property
@@ -47,12 +78,25 @@ class Room(Base):
 
 class Item(Base):
     __tablename__ = 'item'
-
+    # (room_id, id) serves both "items of a room" lookups and their ordered,
+    # keyset-paginated listing, so room_id needs no index of its own; the
+    # same goes for user_id and (user_id, price_cents).
+    # The name and price_cents indexes serve sorting and range filters.
+    __table_args__ = (
+      Index('ix_item_room_id_id', 'room_id', 'id'),
+      Index('ix_item_room_id_name', 'room_id', 'name'),
+      Index('ix_item_room_id_price_cents', 'room_id', 'price_cents'),
+      Index('ix_item_user_id_price_cents', 'user_id', 'price_cents'),
+    )
 
     id = Column(Integer, primary_key = True)
     name = Column(String(80), nullable = False)
     description = Column(String(250))
     price = Column(String(8))
+    # Numeric form of price, kept in sync by validate_price
+    price_cents = Column(Integer)
+    currency = Column(String(3))
+    updated_at = Column(DateTime, default = datetime.utcnow, onupdate = datetime.utcnow)
 
     room_id = Column(Integer, ForeignKey('room.id'), nullable = False)
     room = relationship(Room)
@@ -72,16 +116,365 @@ class Item(Base):
            'price'        : self.price,
        }
 
+    @validates('price')
+    def validate_price(self, key, price):
+       """Keep price_cents and currency in sync with the price text"""
+       self.price_cents, self.currency = parse_price(price)
+       return price
 
-if __name__ == "__main__":
-  # Remove existing database
-  try:
-    remove("room_item_user.db")
-    print("Existing database removed!")
-  except FileNotFoundError:
-    print("No existing database found. Creating new one...")
-
-  engine = create_engine('sqlite:///room_item_user.db')
+class Change(Base):
+    __tablename__ = 'change_log'
+    # Filled by triggers on room and item (see CHANGE_LOG_DDL) and read in
+    # id order per user by /api/changes. AUTOINCREMENT keeps SQLite from
+    # reusing the ids of rows removed by retention, which clients hold as
+    # cursors.
+    __table_args__ = (
+      Index('ix_change_log_user_id_id', 'user_id', 'id'),
+      {'sqlite_autoincrement': True},
+    )
+
+    id = Column(Integer, primary_key = True)
+    user_id = Column(Integer, nullable = False)
+    entity = Column(String(4), nullable = False)     # 'room' or 'item'
+    entity_id = Column(Integer, nullable = False)
+    room_id = Column(Integer)
+    action = Column(String(6), nullable = False)     # 'insert', 'update' or 'delete'
+    created_at = Column(DateTime, nullable = False)
+
+class ChangeLogState(Base):
+    __tablename__ = 'change_log_state'
+    # Single row: changes with an id up to purged_up_to have been removed by
+    # retention, so clients with an older cursor must resynchronize
+
+    id = Column(Integer, primary_key = True)
+    purged_up_to = Column(Integer, nullable = False, default = 0)
+
+class RoomStats(Base):
+    __tablename__ = 'room_stats'
+    # Item count and total value of a room per currency ('' for unpriced
+    # items), maintained by triggers on item (see ROOM_STATS_DDL) so every
+    # write updates it in the same transaction
+
+    room_id = Column(Integer, primary_key = True)
+    currency = Column(String(3), primary_key = True, default = '')
+    item_count = Column(Integer, nullable = False, default = 0)
+    total_cents = Column(Integer, nullable = False, default = 0)
+    updated_at = Column(DateTime)                    # last change to the room's items
+
+class WebSession(Base):
+    __tablename__ = 'web_session'
+    # Server-side session data (see sessions.py); the cookie only holds the id
+
+    id = Column(String(64), primary_key = True)
+    data = Column(Text, nullable = False)            # tagged JSON of the session dict
+    expires = Column(DateTime, nullable = False, index = True)
+
+
+# Full-text index over Item.name and Item.description. It is an external
+# content FTS5 table kept in sync with the item table by triggers, so every
+# write path (ORM, bulk inserts, bulk deletes) updates it. Item.user_id is
+# indexed as a token too, so a search matches "user_id : <id>" inside the
+# index and only reads the matches of one user.
+SEARCH_INDEX_DDL = (
+  """CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5(
+       name, description, user_id, content = 'item', content_rowid = 'id', prefix = '2 3')""",
+  """CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN
+       INSERT INTO item_fts(rowid, name, description, user_id) VALUES (new.id, new.name, new.description, new.user_id);
+     END""",
+  """CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN
+       INSERT INTO item_fts(item_fts, rowid, name, description, user_id) VALUES ('delete', old.id, old.name, old.description, old.user_id);
+     END""",
+  """CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE OF name, description, user_id ON item BEGIN
+       INSERT INTO item_fts(item_fts, rowid, name, description, user_id) VALUES ('delete', old.id, old.name, old.description, old.user_id);
+       INSERT INTO item_fts(rowid, name, description, user_id) VALUES (new.id, new.name, new.description, new.user_id);
+     END""",
+)
+SEARCH_INDEX_DROP = (
+  "DROP TRIGGER IF EXISTS item_fts_insert",
+  "DROP TRIGGER IF EXISTS item_fts_delete",
+  "DROP TRIGGER IF EXISTS item_fts_update",
+  "DROP TABLE IF EXISTS item_fts",
+)
+
+# Change log entries for every insert, update and delete of rooms and items,
+# written by triggers so that bulk writes and cascades are recorded too
+CHANGE_LOG_DDL = tuple(
+  """CREATE TRIGGER IF NOT EXISTS {table}_change_{action} AFTER {event} ON {table} BEGIN
+       INSERT INTO change_log(user_id, entity, entity_id, room_id, action, created_at)
+       VALUES ({row}.user_id, '{table}', {row}.id, {row}.{room_id}, '{action}', CURRENT_TIMESTAMP);
+     END""".format(table = table, room_id = room_id, action = action, event = event, row = row)
+  for table, room_id in (('room', 'id'), ('item', 'room_id'))
+  for action, event, row in (('insert', 'INSERT', 'new'), ('update', 'UPDATE', 'new'), ('delete', 'DELETE', 'old'))
+)
+CHANGE_LOG_DROP = tuple(
+  "DROP TRIGGER IF EXISTS {}_change_{}".format(table, action)
+  for table in ('room', 'item') for action in ('insert', 'update', 'delete')
+)
+
+# Room statistics: an item is added to the row of its (room, currency) on
+# insert, removed from it on delete, and moved between rows on update
+ROOM_STATS_ADD = """INSERT INTO room_stats(room_id, currency, item_count, total_cents, updated_at)
+       VALUES (new.room_id, COALESCE(new.currency, ''), 1, COALESCE(new.price_cents, 0), CURRENT_TIMESTAMP)
+       ON CONFLICT(room_id, currency) DO UPDATE SET item_count = item_count + 1,
+         total_cents = total_cents + excluded.total_cents, updated_at = excluded.updated_at;"""
+ROOM_STATS_REMOVE = """UPDATE room_stats SET item_count = item_count - 1,
+         total_cents = total_cents - COALESCE(old.price_cents, 0), updated_at = CURRENT_TIMESTAMP
+       WHERE room_id = old.room_id AND currency = COALESCE(old.currency, '');"""
+ROOM_STATS_DDL = (
+  "CREATE TRIGGER IF NOT EXISTS room_stats_insert AFTER INSERT ON item BEGIN {} END".format(ROOM_STATS_ADD),
+  "CREATE TRIGGER IF NOT EXISTS room_stats_delete AFTER DELETE ON item BEGIN {} END".format(ROOM_STATS_REMOVE),
+  "CREATE TRIGGER IF NOT EXISTS room_stats_update AFTER UPDATE ON item BEGIN {} {} END".format(
+    ROOM_STATS_REMOVE, ROOM_STATS_ADD),
+  """CREATE TRIGGER IF NOT EXISTS room_stats_room_delete AFTER DELETE ON room BEGIN
+       DELETE FROM room_stats WHERE room_id = old.id;
+     END""",
+)
+
+# Room statistics computed from the item table, to rebuild and verify room_stats
+ROOM_STATS_QUERY = """
+  SELECT room_id, COALESCE(currency, '') AS currency, COUNT(*) AS item_count,
+    COALESCE(SUM(price_cents), 0) AS total_cents
+  FROM item GROUP BY room_id, COALESCE(currency, '')"""
+
+def create_room_stats(engine):
+  """Create the room statistics table and its triggers if they are missing"""
+  Base.metadata.create_all(engine, tables = [RoomStats.__table__])
+  with engine.begin() as connection:
+    for statement in ROOM_STATS_DDL:
+      connection.execute(text(statement))
+
+def rebuild_room_stats(engine):
+  """Refill the room statistics from the item table"""
+  create_room_stats(engine)
+  with engine.begin() as connection:
+    connection.execute(text("DELETE FROM room_stats"))
+    connection.execute(text(
+      "INSERT INTO room_stats(room_id, currency, item_count, total_cents, updated_at) "
+      "SELECT room_id, currency, item_count, total_cents, CURRENT_TIMESTAMP FROM ({})".format(ROOM_STATS_QUERY)))
+
+def verify_room_stats(engine):
+  """Return the rows of room_stats that differ from the item table, as
+  (room_id, currency, stored (count, cents), actual (count, cents))"""
+  with engine.connect() as connection:
+    actual = dict(((row.room_id, row.currency), (row.item_count, row.total_cents))
+      for row in connection.execute(text(ROOM_STATS_QUERY)))
+    stored = dict(((row.room_id, row.currency), (row.item_count, row.total_cents))
+      for row in connection.execute(text(
+        "SELECT room_id, currency, item_count, total_cents FROM room_stats")))
+  drift = []
+  for room_id, currency in sorted(set(actual) | set(stored)):
+    key = (room_id, currency)
+    if stored.get(key, (0, 0)) != actual.get(key, (0, 0)):
+      drift.append((room_id, currency, stored.get(key, (0, 0)), actual.get(key, (0, 0))))
+  return drift
+
+def create_change_log(engine):
+  """Create the change log triggers if they are missing"""
+  Base.metadata.create_all(engine, tables = [Change.__table__, ChangeLogState.__table__])
+  with engine.begin() as connection:
+    for statement in CHANGE_LOG_DDL:
+      connection.execute(text(statement))
+
+def upgrade_change_log(engine):
+  """Recreate a change log table created without AUTOINCREMENT, keeping
+  its rows, so that ids are never reused once retention removed them.
+  Return True if the table was recreated."""
+  with engine.begin() as connection:
+    ddl = connection.execute(text(
+      "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")).scalar()
+    if ddl is None or "AUTOINCREMENT" in ddl.upper():
+      return False
+    for statement in CHANGE_LOG_DROP:
+      connection.execute(text(statement))
+    connection.execute(text("DROP INDEX IF EXISTS ix_change_log_user_id_id"))
+    connection.execute(text("ALTER TABLE change_log RENAME TO change_log_old"))
+    Change.__table__.create(connection)
+    connection.execute(text("INSERT INTO change_log SELECT * FROM change_log_old"))
+    connection.execute(text("DROP TABLE change_log_old"))
+    # Continue after the purged ids too, in case retention emptied the table
+    purged_up_to = connection.execute(text(
+      "SELECT purged_up_to FROM change_log_state WHERE id = 1")).scalar() or 0
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'change_log'"))
+    connection.execute(text(
+      "INSERT INTO sqlite_sequence(name, seq) "
+      "SELECT 'change_log', MAX(:purged_up_to, COALESCE(MAX(id), 0)) FROM change_log"),
+      {'purged_up_to': purged_up_to})
+  return True
+
+def compact_change_log(engine, retention_days = 30):
+  """Keep only the latest change of every room and item, and remove
+  changes older than retention_days. Return the number of removed rows."""
+  with engine.begin() as connection:
+    removed = connection.execute(text(
+      """DELETE FROM change_log WHERE id NOT IN
+           (SELECT MAX(id) FROM change_log GROUP BY entity, entity_id)""")).rowcount
+
+    cutoff = datetime.utcnow() - timedelta(days = retention_days)
+    purged_up_to = connection.execute(text(
+      "SELECT MAX(id) FROM change_log WHERE created_at < :cutoff"),
+      {'cutoff': cutoff.strftime("%Y-%m-%d %H:%M:%S")}).scalar()
+    if purged_up_to is not None:
+      removed += connection.execute(text(
+        "DELETE FROM change_log WHERE id <= :id"), {'id': purged_up_to}).rowcount
+      updated = connection.execute(text(
+        "UPDATE change_log_state SET purged_up_to = :id WHERE id = 1"), {'id': purged_up_to}).rowcount
+      if not updated:
+        connection.execute(text(
+          "INSERT INTO change_log_state(id, purged_up_to) VALUES (1, :id)"), {'id': purged_up_to})
+  return removed
+
+def sweep_sessions(engine):
+  """Remove expired server-side sessions. Return the number of removed rows."""
+  with engine.begin() as connection:
+    return connection.execute(WebSession.__table__.delete().where(
+      WebSession.expires < datetime.utcnow())).rowcount
+
+def bump_revision(session, user_id):
+  """Bump the revision of a user's data within the current transaction of
+  session (or connection), to be committed with the writes it covers"""
+  user_table = User.__table__
+  session.execute(user_table.update().where(user_table.c.id == user_id).values(
+    revision = func.coalesce(user_table.c.revision, 0) + 1, updated_at = datetime.utcnow()))
+
+def setup_db(engine):
+  """Create all tables, indexes and triggers of a new database"""
   Base.metadata.create_all(engine)
+  create_search_index(engine)
+  create_change_log(engine)
+  create_room_stats(engine)
+
+def create_search_index(engine):
+  """Create the item search index and its triggers if they are missing"""
+  with engine.begin() as connection:
+    for statement in SEARCH_INDEX_DDL:
+      connection.execute(text(statement))
+
+def rebuild_search_index(engine):
+  """Recreate the item search index with the current columns and refill
+  it from the item table"""
+  with engine.begin() as connection:
+    for statement in SEARCH_INDEX_DROP:
+      connection.execute(text(statement))
+  create_search_index(engine)
+  with engine.begin() as connection:
+    connection.execute(text("INSERT INTO item_fts(item_fts) VALUES ('rebuild')"))
+
+
+def backfill_prices(engine):
+  """Parse the price text of items whose price_cents is not set yet"""
+  with engine.begin() as connection:
+    rows = connection.execute(text(
+      "SELECT id, price FROM item WHERE price_cents IS NULL AND price IS NOT NULL")).fetchall()
+    updates = []
+    for item_id, price in rows:
+      cents, currency = parse_price(price)
+      if cents is not None:
+        updates.append({'id': item_id, 'cents': cents, 'currency': currency})
+    if updates:
+      connection.execute(text(
+        "UPDATE item SET price_cents = :cents, currency = :currency WHERE id = :id"), updates)
+  return len(updates)
+
+# Indexes of earlier versions made redundant by composite ones
+OBSOLETE_INDEXES = ('ix_item_user_id',)
+
+def upgrade_db(engine):
+  """Bring an existing database up to date with the models without
+  losing its data: create missing tables, columns and indexes"""
+  Base.metadata.create_all(engine)
+  inspector = inspect(engine)
+  for table in Base.metadata.sorted_tables:
+    existing = set(column['name'] for column in inspector.get_columns(table.name))
+    for column in table.columns:
+      if column.name not in existing:
+        ddl = "ALTER TABLE {} ADD COLUMN {} {}".format(
+          table.name, column.name, column.type.compile(engine.dialect))
+        if column.default is not None and column.default.is_scalar:
+          ddl += " NOT NULL DEFAULT {!r}".format(column.default.arg)
+        with engine.begin() as connection:
+          connection.execute(text(ddl))
+        print("Column {}.{} added".format(table.name, column.name))
+  print("{} item prices converted".format(backfill_prices(engine)))
+
+  for table in Base.metadata.sorted_tables:
+    existing = set(index['name'] for index in inspector.get_indexes(table.name))
+    for index in table.indexes:
+      if index.name not in existing:
+        index.create(engine)
+        print("Index {} created".format(index.name))
+  for name in OBSOLETE_INDEXES:
+    with engine.begin() as connection:
+      connection.execute(text("DROP INDEX IF EXISTS {}".format(name)))
+  rebuild_search_index(engine)
+  print("Search index rebuilt")
+  if upgrade_change_log(engine):
+    print("Change log recreated with AUTOINCREMENT ids")
+  create_change_log(engine)
+  rebuild_room_stats(engine)
+  print("Room statistics rebuilt")
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1 and sys.argv[1] == "upgrade":
+    # Migrate the existing database in place
+    engine = create_db_engine()
+    upgrade_db(engine)
+    print("Database sucessfully upgraded!")
+    sys.exit()
+
+  if len(sys.argv) > 1 and sys.argv[1] == "compact-changes":
+    # Compact the change log and apply retention (default: 30 days)
+    engine = create_db_engine()
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print("{} changes removed".format(compact_change_log(engine, days)))
+    sys.exit()
+
+  if len(sys.argv) > 1 and sys.argv[1] == "sweep-sessions":
+    # Remove expired server-side sessions
+    engine = create_db_engine()
+    print("{} expired sessions removed".format(sweep_sessions(engine)))
+    sys.exit()
+
+  if len(sys.argv) > 1 and sys.argv[1] == "verify-room-stats":
+    # Compare the room statistics with the items and repair any drift
+    engine = create_db_engine()
+    drift = verify_room_stats(engine)
+    for room_id, currency, stored, actual in drift:
+      print("Room {} {}: stored {} items / {} cents, actual {} items / {} cents".format(
+        room_id, currency or "(no price)", stored[0], stored[1], actual[0], actual[1]))
+    if drift:
+      rebuild_room_stats(engine)
+      print("Room statistics rebuilt")
+    else:
+      print("Room statistics are up to date")
+    sys.exit()
+
+  if len(sys.argv) > 1 and sys.argv[1] == "rebuild-search":
+    # Backfill the search index of an existing database
+    engine = create_db_engine()
+    rebuild_search_index(engine)
+    print("Search index sucessfully rebuilt!")
+    sys.exit()
+
+  # Remove existing database (its file for SQLite, its tables otherwise)
+  engine = create_db_engine()
+  if engine.url.get_backend_name() == 'sqlite':
+    try:
+      remove(engine.url.database)
+      print("Existing database removed!")
+    except FileNotFoundError:
+      print("No existing database found. Creating new one...")
+    # A leftover write-ahead log must not be applied to the new database
+    for suffix in ("-wal", "-shm"):
+      try:
+        remove(engine.url.database + suffix)
+      except FileNotFoundError:
+        pass
+    engine.dispose()
+  else:
+    Base.metadata.drop_all(engine)
+    print("Existing tables removed!")
+
+  setup_db(engine)
   print("Database sucessfully set up!")
   print("Type 'python populate_db.py' in your terminal to populate the database")
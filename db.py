@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Database engines and sessions shared by the app and the scripts.
+#
+# create_db_engine builds an engine from a database URL and the DB_*
+# settings of config.py (pool size, overflow, recycle, pre-ping). SQLite
+# connections are tuned with PRAGMAs: WAL, synchronous, mmap_size,
+# cache_size and busy_timeout. RoutingSession sends the reads of sessions
+# marked read-only to a replica engine, and everything else to the primary.
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+from config import Config
+
+
+def setting(config, name):
+	# Return a setting from config, or its default from Config
+	if config is not None and name in config:
+		return config[name]
+	return getattr(Config, name)
+
+def create_db_engine(url = None, config = None, read_only = False):
+	# Return an engine for url (default: DATABASE_URL). config is a mapping
+	# such as app.config overriding the defaults of Config. Connections of a
+	# read_only engine refuse writes.
+	url = make_url(url or setting(config, 'DATABASE_URL'))
+	options = {
+		'pool_pre_ping' : setting(config, 'DB_POOL_PRE_PING'),
+		'pool_recycle'  : setting(config, 'DB_POOL_RECYCLE'),
+	}
+	is_sqlite = url.get_backend_name() == 'sqlite'
+	in_memory = is_sqlite and url.database in (None, '', ':memory:')
+
+	if is_sqlite:
+		busy_timeout = setting(config, 'DB_BUSY_TIMEOUT')
+		options['connect_args'] = {'check_same_thread': False, 'timeout': busy_timeout}
+	if not in_memory:
+		options.update(poolclass = QueuePool, pool_size = setting(config, 'DB_POOL_SIZE'),
+			max_overflow = setting(config, 'DB_MAX_OVERFLOW'))
+
+	engine = create_engine(url, **options)
+
+	if is_sqlite:
+		pragmas = [
+			# WAL lets readers run alongside a writer; busy_timeout makes writers
+			# wait for the lock instead of failing with "database is locked"
+			"journal_mode=WAL",
+			"busy_timeout={}".format(busy_timeout * 1000),
+			# NORMAL only syncs at checkpoints, which is safe with WAL
+			"synchronous={}".format(setting(config, 'DB_SQLITE_SYNCHRONOUS')),
+			"mmap_size={}".format(setting(config, 'DB_SQLITE_MMAP_SIZE')),
+			"cache_size={}".format(setting(config, 'DB_SQLITE_CACHE_SIZE')),
+		]
+		if read_only:
+			pragmas.append("query_only=ON")
+
+		@event.listens_for(engine, "connect")
+		def set_sqlite_pragma(dbapi_connection, connection_record):
+			cursor = dbapi_connection.cursor()
+			for pragma in pragmas:
+				cursor.execute("PRAGMA " + pragma)
+			cursor.close()
+
+	return engine
+
+
+class RoutingSession(Session):
+	# Session that reads from info['replica'] while info['read_only'] is set.
+	# Flushes and INSERT/UPDATE/DELETE statements always go to the primary
+	# bind, so a write never reaches the replica.
+
+	def get_bind(self, mapper = None, clause = None, **kwargs):
+		replica = self.info.get('replica')
+		if replica is not None and self.info.get('read_only') and \
+			not self._flushing and not isinstance(clause, UpdateBase):
+			return replica
+		return Session.get_bind(self, mapper, clause, **kwargs)
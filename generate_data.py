@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Populate a database with a configurable amount of random, seeded test data.
+#
+# Usage:
+#   python generate_data.py [--users 1] [--rooms 20] [--items 100] [--seed 0]
+#                           [--db <database URL>]
+
+from database_setup import User, Room, Item, setup_db
+from db import create_db_engine
+
+import argparse
+import random
+
+WORDS = ("oak", "walnut", "linen", "velvet", "steel", "glass", "ceramic",
+	"bamboo", "marble", "copper", "vintage", "modern", "rustic", "compact",
+	"folding", "wireless", "smart", "ergonomic", "hand-made", "classic",
+	"chair", "table", "lamp", "shelf", "rug", "cabinet", "mirror", "clock",
+	"sofa", "desk", "bench", "stool", "vase", "curtain", "speaker", "kettle")
+ROOM_NAMES = ("Living Room", "Bed Room", "Bath Room", "Kitchen", "Dining Room",
+	"Office", "Garage", "Attic", "Basement", "Hallway", "Laundry", "Nursery",
+	"Guest Room", "Pantry", "Porch", "Study")
+
+
+def random_words(rng, low, high, max_length):
+	# Return between low and high random words, cut to max_length characters
+	return " ".join(rng.choice(WORDS) for i in range(rng.randint(low, high)))[:max_length]
+
+def generate(engine, users = 1, rooms_per_user = 20, items_per_room = 100, seed = 0):
+	# Insert users, rooms and items in bulk and return the users' emails.
+	# The same seed always produces the same data.
+	rng = random.Random(seed)
+	emails = []
+
+	with engine.begin() as connection:
+		for u in range(users):
+			email = "user{}-{}@example.com".format(seed, u)
+			user_id = connection.execute(User.__table__.insert().values(
+				name = "User {}".format(u), email = email)).inserted_primary_key[0]
+			emails.append(email)
+
+			for r in range(rooms_per_user):
+				room_name = "{} {}".format(rng.choice(ROOM_NAMES), r + 1)
+				room_id = connection.execute(Room.__table__.insert().values(
+					name = room_name, user_id = user_id)).inserted_primary_key[0]
+
+				if items_per_room:
+					prices = [rng.randint(1, 9999) for i in range(items_per_room)]
+					connection.execute(Item.__table__.insert(), [{
+						'name'        : random_words(rng, 1, 3, 80).title(),
+						'description' : random_words(rng, 5, 20, 250).capitalize(),
+						'price'       : "$ {}".format(price),
+						'price_cents' : price * 100,
+						'currency'    : "USD",
+						'room_id'     : room_id,
+						'user_id'     : user_id,
+					} for price in prices])
+
+	return emails
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Populate a database with random test data")
+	parser.add_argument("--users", type = int, default = 1, help = "number of users")
+	parser.add_argument("--rooms", type = int, default = 20, help = "rooms per user")
+	parser.add_argument("--items", type = int, default = 100, help = "items per room")
+	parser.add_argument("--seed", type = int, default = 0, help = "random seed")
+	parser.add_argument("--db", help = "database URL (default: DATABASE_URL)")
+	args = parser.parse_args()
+
+	engine = create_db_engine(args.db)
+	setup_db(engine)
+	emails = generate(engine, args.users, args.rooms, args.items, args.seed)
+
+	print("Database successfully populated for: {}".format(", ".join(emails)))
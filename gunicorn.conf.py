@@ -0,0 +1,18 @@
+# gunicorn settings, used with: gunicorn -c gunicorn.conf.py wsgi:app
+# WEB_CONCURRENCY, THREADS and BIND override the defaults below.
+
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('THREADS', 4))
+
+# Load and warm up the app once in the master; workers are forked from it
+# with compiled templates and a primed cache, and open their own database
+# connections (see create_app in main.py)
+preload_app = True
+
+timeout = 30
+graceful_timeout = 30
+accesslog = '-'
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# Bulk import of rooms and items from CSV, JSON or NDJSON files.
+#
+# Accepted formats:
+#   csv    - header row with the columns room,name,description,price
+#   json   - the document returned by /JSON: {"Rooms": [{"name", "items"}]}
+#   ndjson - the stream returned by /api/export, one room or item per line
+#
+# Usage from the command line:
+#   python importer.py <user email> <file> [--format csv] [--batch-size 1000]
+
+from sqlalchemy.orm import sessionmaker
+
+from database_setup import Base, User, Room, Item, parse_price, bump_revision
+from db import create_db_engine
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+FORMATS = ("csv", "json", "ndjson")
+DEFAULT_BATCH_SIZE = 1000
+
+# Maximum lengths of the imported columns, as declared in database_setup.py
+MAX_LENGTHS = {
+	'room'        : Room.__table__.c.name.type.length,
+	'name'        : Item.__table__.c.name.type.length,
+	'description' : Item.__table__.c.description.type.length,
+	'price'       : Item.__table__.c.price.type.length,
+}
+
+
+class RowError(Exception):
+	# Raised for a row that cannot be imported; the import carries on
+	pass
+
+
+def guess_format(filename):
+	# Return the import format matching a file name's extension, or None
+	extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+	if extension in FORMATS:
+		return extension
+	return None
+
+def iter_json_records(fileobj):
+	# Yield (record number, kind, fields) for a document in the /JSON format.
+	# The stdlib parser loads the whole document; prefer ndjson for big files.
+	# Rooms and items that are not JSON objects are yielded as errors.
+	document = json.load(fileobj)
+	if not isinstance(document, dict):
+		raise ValueError("Expected a JSON object with a Rooms list")
+	rooms = document.get("Rooms", [])
+	if not isinstance(rooms, list):
+		raise ValueError("Rooms must be a list")
+
+	number = 0
+	for room in rooms:
+		number += 1
+		if not isinstance(room, dict):
+			yield number, "error", "Expected a room object"
+			continue
+		yield number, "room", room
+
+		items = room.get("items", [])
+		if not isinstance(items, list):
+			number += 1
+			yield number, "error", "items must be a list"
+			continue
+		for item in items:
+			number += 1
+			if not isinstance(item, dict):
+				yield number, "error", "Expected an item object"
+				continue
+			yield number, "item", dict(item, room = room.get("name"))
+
+def iter_ndjson_records(fileobj):
+	# Yield (line number, kind, fields) for every line of an NDJSON stream
+	for number, line in enumerate(fileobj, 1):
+		line = line.strip()
+		if not line:
+			continue
+		try:
+			record = json.loads(line)
+		except ValueError as e:
+			yield number, "error", "Invalid JSON: {}".format(e)
+			continue
+		if not isinstance(record, dict):
+			yield number, "error", "Expected a JSON object"
+			continue
+		yield number, record.get("type", "item"), record
+
+def iter_records(fileobj, file_format):
+	# Return a record iterator for the given format
+	if file_format == "csv":
+		reader = csv.DictReader(fileobj)
+		return ((reader.line_num, "item", row) for row in reader)
+	if file_format == "json":
+		return iter_json_records(fileobj)
+	if file_format == "ndjson":
+		return iter_ndjson_records(fileobj)
+	raise ValueError("Unknown import format: {}".format(file_format))
+
+def clean_field(record, field, required = False):
+	# Return a stripped string value of a field, checking its length
+	value = record.get(field)
+	if value is None:
+		value = ""
+	value = str(value).strip()
+	if required and not value:
+		raise RowError("Missing {}".format(field))
+	if len(value) > MAX_LENGTHS[field]:
+		raise RowError("{} is longer than {} characters".format(field, MAX_LENGTHS[field]))
+	return value
+
+def validate_item(record):
+	# Return the column values of an item record, or raise RowError
+	return {
+		'room'        : clean_field(record, 'room', required = True),
+		'name'        : clean_field(record, 'name', required = True),
+		'description' : clean_field(record, 'description'),
+		'price'       : clean_field(record, 'price'),
+	}
+
+
+def import_records(session, user_id, records, batch_size = DEFAULT_BATCH_SIZE):
+	# Import records for the user with the given id.
+	# Items are written with executemany INSERTs, one transaction per batch.
+	# Every batch that writes also bumps the user's revision, so cached pages
+	# and ETags never outlive the imported data. Rooms are matched by name
+	# and created when missing. Invalid rows are reported and skipped without
+	# aborting the rest of the import. A file that cannot be read further
+	# (bad encoding, malformed document) stops the import: the current batch
+	# is rolled back, the report counts the committed batches only and its
+	# "error" holds the reason.
+	room_ids = dict(session.query(Room.name, Room.id).filter_by(user_id = user_id))
+	item_table = Item.__table__
+	report = {'rooms_created': 0, 'items_imported': 0, 'errors': []}
+	batch = []
+	rooms_created = []
+
+	def get_room_id(name):
+		if name not in room_ids:
+			result = session.execute(Room.__table__.insert().values(name = name, user_id = user_id))
+			room_ids[name] = result.inserted_primary_key[0]
+			rooms_created.append(room_ids[name])
+		return room_ids[name]
+
+	def flush():
+		if batch:
+			session.execute(item_table.insert(), batch)
+		if batch or rooms_created:
+			bump_revision(session, user_id)
+		session.commit()
+		report['items_imported'] += len(batch)
+		report['rooms_created'] += len(rooms_created)
+		del batch[:]
+		del rooms_created[:]
+
+	try:
+		for number, kind, record in records:
+			try:
+				if kind == "error":
+					raise RowError(record)
+				if kind == "room":
+					get_room_id(clean_field({'room': record.get("name")}, 'room', required = True))
+					continue
+				if kind != "item":
+					raise RowError("Unknown record type: {}".format(kind))
+
+				values = validate_item(record)
+				price_cents, currency = parse_price(values['price'])
+				batch.append({
+					'name'        : values['name'],
+					'description' : values['description'],
+					'price'       : values['price'],
+					'price_cents' : price_cents,
+					'currency'    : currency,
+					'room_id'     : get_room_id(values['room']),
+					'user_id'     : user_id,
+				})
+			except RowError as e:
+				report['errors'].append({'row': number, 'error': str(e)})
+				continue
+
+			if len(batch) >= batch_size:
+				flush()
+	except (ValueError, UnicodeDecodeError, csv.Error) as e:
+		session.rollback()
+		report['error'] = str(e)
+		return report
+
+	flush()
+	return report
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "Import rooms and items for a user")
+	parser.add_argument("email", help = "email address of the owner of the imported data")
+	parser.add_argument("file", help = "CSV, JSON or NDJSON file to import")
+	parser.add_argument("--format", choices = FORMATS, help = "file format (default: from file extension)")
+	parser.add_argument("--batch-size", type = int, default = DEFAULT_BATCH_SIZE, help = "rows per transaction")
+	args = parser.parse_args()
+
+	file_format = args.format or guess_format(args.file)
+	if file_format is None:
+		parser.error("Cannot tell the format of {}, use --format".format(args.file))
+
+	engine = create_db_engine()
+	Base.metadata.bind = engine
+	DBSession = sessionmaker(bind = engine)
+	session = DBSession()
+
+	user = session.query(User).filter_by(email = args.email).first()
+	if user is None:
+		parser.error("No user found for email: {}".format(args.email))
+
+	with open(args.file, "r", newline = "") as fileobj:
+		report = import_records(session, user.id, iter_records(fileobj, file_format), args.batch_size)
+
+	print("{} rooms created, {} items imported".format(report['rooms_created'], report['items_imported']))
+	for error in report['errors']:
+		print("Row {}: {}".format(error['row'], error['error']))
+	if 'error' in report:
+		print("Import stopped, the rest of the file was not read: {}".format(report['error']))
+		sys.exit(1)
@@ -2,36 +2,98 @@
 
 from flask import Flask, render_template, request, redirect, jsonify, url_for, flash
 from flask import session as login_session
-from flask import make_response
+from flask import make_response, Response, stream_with_context, g
+from flask.sessions import SecureCookieSessionInterface
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 import random, string
-
-from sqlalchemy import create_engine, asc
-from sqlalchemy.orm import sessionmaker
+import io
+import os
+import re
+from functools import wraps
+from collections import namedtuple
+
+from sqlalchemy import asc, text, func, or_, and_
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.exc import NoResultFound
-from database_setup import Base, User, Room, Item
+from database_setup import Base, User, Room, Item, RoomStats, Change, ChangeLogState
+from database_setup import parse_price, bump_revision, CURRENCY_SYMBOLS
+from cache import LRUCache
+from markupsafe import Markup
+import importer
+import batch
+import serialization
+from profiling import Profiler
+from ratelimit import Limiter, MemoryBucketStore, SQLBucketStore
+from sessions import ServerSessionInterface, SQLStore, MemoryStore
 
 
-from oauth2client.client import flow_from_clientsecrets
 from oauth2client.client import FlowExchangeError
-import httplib2
+from config import Config, ClientSecrets
+from db import create_db_engine, RoutingSession
+import oauth_http
 import json
 
-import requests
-
-from copy import deepcopy
-
-# Create an app instance
+# Create an app instance; create_app() loads its settings (see config.py)
+# and connects it to the database
 app = Flask(__name__)
 
-# Connect to database and create database session
-engine = create_engine('sqlite:///room_item_user.db')
-Base.metadata.bind = engine
-DBSession = sessionmaker(bind = engine)
-session = DBSession()
+# Set by create_app()
+engine = None
+replica_engine = None # read-only copy of the database, if configured
+client_secrets = None # OAuth client secrets, reloaded when the file changes
+warmed_up = False
+
+# Create a database session per thread/request; it is removed when the
+# request ends so a failed transaction never leaks into the next request
+DBSession = sessionmaker(class_ = RoutingSession)
+session = scoped_session(DBSession)
+
+@app.teardown_appcontext
+def remove_session(exception = None):
+	session.remove()
+
+@app.before_request
+def route_reads():
+	# With a replica, GET requests read from it unless their view is marked
+	# with @primary_db; writes always go to the primary database
+	view = app.view_functions.get(request.endpoint)
+	session.info['read_only'] = request.method in ("GET", "HEAD") and \
+		not getattr(view, "primary_db", False)
+
+def primary_db(f):
+	# Mark a GET view that writes, so all of its queries use the primary
+	# database and see its own writes
+	f.primary_db = True
+	return f
 
 # Constants
-CLIENT_ID = json.loads(open('client_secrets.json', 'r').read())['web']['client_id']
+API_PAGE_SIZE = 50 # default number of records per page of the paginated API
+API_MAX_PAGE_SIZE = 500 # upper bound for the "limit" query parameter
+ROOMS_CACHE_SIZE = 1024 # number of users whose room list is cached
+ROOMS_CACHE_TTL = 300 # seconds before a cached room list is reloaded
+SEARCH_PAGE_SIZE = 20 # number of search results per page
+ITEMS_PAGE_SIZE = 50 # number of items per page of the items table
+FRAGMENT_CACHE_SIZE = 1024 # number of rendered page fragments kept
+FRAGMENT_CACHE_TTL = 300 # seconds before a cached fragment is re-rendered
+ETAG_VERSION = "2" # change when the format of pages or API responses changes
+
+# Lightweight room record used to render room lists and the left-side bar:
+# items is the item count, totals the total value per currency ({code: cents})
+# and updated_at the time of the last change to the room's items
+RoomSummary = namedtuple("RoomSummary", ["id", "name", "items", "totals", "updated_at"])
+
+# Per-user room lists, keyed on the user's revision which every write
+# route bumps (see commit_changes)
+rooms_cache = LRUCache(max_size = ROOMS_CACHE_SIZE, ttl = ROOMS_CACHE_TTL)
+
+# Rendered HTML fragments of the room lists and item tables, keyed on the
+# user's revision which every write route bumps (see commit_changes)
+fragment_cache = LRUCache(max_size = FRAGMENT_CACHE_SIZE, ttl = FRAGMENT_CACHE_TTL)
+
+profiler = Profiler()
+profiler.add_stats_provider("rooms_cache", rooms_cache.stats)
+profiler.add_stats_provider("fragment_cache", fragment_cache.stats)
 
 # Helper functions
 def get_room_from_id(room_id):
@@ -51,9 +113,270 @@ def get_item_from_id(item_id):
 		return None
 
 def get_rooms():
-	# Return all Room instances belonging the user that is currently logged in
-	owner_id = getUserID(login_session.get("email"))
-	return session.query(Room).filter_by(user_id = owner_id)
+	# Return the RoomSummary of all rooms belonging the user that is
+	# currently logged in. The list is served from rooms_cache when possible.
+	user_id = get_current_user_id()
+	if user_id is None:
+		return ()
+
+	return rooms_cache.get_or_set((user_id, get_revision()[0]), lambda: load_rooms(user_id))
+
+def load_rooms(user_id):
+	# Return the RoomSummary of all rooms of a user, read with one query
+	# from the rooms and their statistics (maintained by triggers, see
+	# RoomStats in database_setup.py)
+	rows = session.query(Room.id, Room.name, RoomStats.currency, RoomStats.item_count,
+		RoomStats.total_cents, RoomStats.updated_at).\
+		outerjoin(RoomStats, RoomStats.room_id == Room.id).\
+		filter(Room.user_id == user_id).order_by(Room.id)
+
+	rooms = []
+	for room_id, name, currency, count, cents, updated_at in rows:
+		if not rooms or rooms[-1].id != room_id:
+			rooms.append(RoomSummary(room_id, name, 0, {}, None))
+		room = rooms[-1]
+		if count:
+			if currency:
+				room.totals[currency] = cents
+			room = room._replace(items = room.items + count)
+		if updated_at is not None and (room.updated_at is None or updated_at > room.updated_at):
+			room = room._replace(updated_at = updated_at)
+		rooms[-1] = room
+	return tuple(rooms)
+
+def get_revision():
+	# Return (revision, updated_at) of the logged-in user's data, read once
+	# per request. Every write to the user's rooms or items bumps it.
+	if "revision" not in g:
+		revision, updated_at = session.query(User.revision, User.updated_at).\
+			filter_by(id = g.user_id).one()
+		g.revision = (revision or 0, updated_at)
+	return g.revision
+
+def commit_changes():
+	# Commit the pending writes of the logged-in user together with a bump of
+	# his/her revision, so the cached data of the old revision is not used
+	bump_revision(session, g.user_id)
+	session.commit()
+	g.pop("revision", None)
+
+def conditional(f):
+	# Decorator answering GET requests with 304 Not Modified when the client
+	# already has the current revision of the user's data, checked with one
+	# single-row query before the view runs. Otherwise the response gets a
+	# strong ETag and a Last-Modified header.
+	@wraps(f)
+	def decorated_function(*args, **kwargs):
+		# Pages showing flashed messages must be rendered to consume them
+		if request.method != "GET" or get_current_user_id() is None or \
+			login_session.get("_flashes"):
+			return f(*args, **kwargs)
+
+		revision, updated_at = get_revision()
+		etag = "{}-{}-{}".format(ETAG_VERSION, g.user_id, revision)
+		last_modified = updated_at.replace(microsecond = 0) if updated_at else None
+
+		not_modified = request.if_none_match.contains(etag)
+		if not request.if_none_match and last_modified and request.if_modified_since:
+			not_modified = request.if_modified_since.replace(tzinfo = None) >= last_modified
+
+		if not_modified:
+			response = make_response("", 304)
+		else:
+			response = make_response(f(*args, **kwargs))
+			if response.status_code != 200:
+				return response
+
+		response.set_etag(etag)
+		if last_modified:
+			response.last_modified = last_modified
+		response.cache_control.private = True
+		response.cache_control.no_cache = True
+		return response
+	return decorated_function
+
+def render_fragment(key, template, get_context):
+	# Return the HTML of a template fragment, rendered with the context
+	# returned by get_context. It is cached per user and revision, so a
+	# hit skips both the queries in get_context and the template rendering.
+	key = (g.user_id, get_revision()[0]) + key
+	html = fragment_cache.get(key)
+	if html is None:
+		html = render_template(template, **get_context())
+		fragment_cache.set(key, html)
+	return Markup(html)
+
+@app.template_global()
+def room_list(room_id = None):
+	# Return the room links of the left-side bar, highlighting room_id
+	if get_current_user_id() is None:
+		return ""
+	if not isinstance(room_id, int):
+		room_id = None
+	return render_fragment(("roomlist", room_id), "roomlist.html",
+		lambda: dict(rooms = get_rooms(), room_id = room_id))
+
+CURRENCY_PREFIXES = dict((code, symbol) for symbol, code in CURRENCY_SYMBOLS.items())
+
+@app.template_filter("price")
+def format_price(cents, currency = "USD"):
+	# Return an amount in cents as text, e.g. "$ 1,234.50"
+	if cents is None:
+		return ""
+	return "{} {:,.2f}".format(CURRENCY_PREFIXES.get(currency, currency), cents / 100.0)
+
+def query_items_by_price(owner_id, room_id = None, min_cents = None, max_cents = None,
+		descending = False, after = None, limit = API_PAGE_SIZE):
+	# Return one page of a user's priced items sorted by price, optionally
+	# within a room and a price range. Pages are keyed on (price_cents, id).
+	query = session.query(Item.id, Item.name, Item.description, Item.price,
+		Item.price_cents, Item.currency, Item.room_id).\
+		filter(Item.user_id == owner_id, Item.price_cents != None)
+
+	if room_id is not None:
+		query = query.filter(Item.room_id == room_id)
+	if min_cents is not None:
+		query = query.filter(Item.price_cents >= min_cents)
+	if max_cents is not None:
+		query = query.filter(Item.price_cents <= max_cents)
+
+	if after is not None:
+		after_cents, after_id = after
+		if descending:
+			query = query.filter(or_(Item.price_cents < after_cents,
+				and_(Item.price_cents == after_cents, Item.id < after_id)))
+		else:
+			query = query.filter(or_(Item.price_cents > after_cents,
+				and_(Item.price_cents == after_cents, Item.id > after_id)))
+
+	if descending:
+		query = query.order_by(Item.price_cents.desc(), Item.id.desc())
+	else:
+		query = query.order_by(Item.price_cents, Item.id)
+	return query.limit(limit).all()
+
+# Columns the items table can be sorted by; each has a (room_id, column) index
+ITEM_SORT_COLUMNS = {'id': Item.id, 'name': Item.name, 'price': Item.price_cents}
+
+def keyset_filter(column, value, after_id, descending):
+	# Return the condition selecting rows after (value, after_id) when sorting
+	# by (column, id). SQLite sorts NULLs first ascending and last descending.
+	if descending:
+		if value is None:
+			return and_(column == None, Item.id < after_id)
+		return or_(column < value, column == None, and_(column == value, Item.id < after_id))
+	if value is None:
+		return or_(column != None, and_(column == None, Item.id > after_id))
+	return or_(column > value, and_(column == value, Item.id > after_id))
+
+def query_room_items(room_id, sort = 'id', descending = False, name_filter = None,
+		after = None, limit = ITEMS_PAGE_SIZE):
+	# Return one page of the items of a room with the columns the items table
+	# shows, sorted by sort and then id. after is the (sort value, id) of the
+	# last item of the previous page.
+	column = ITEM_SORT_COLUMNS[sort]
+	query = session.query(Item.id, Item.name, Item.description, Item.price,
+		Item.price_cents).filter(Item.room_id == room_id)
+
+	if name_filter:
+		query = query.filter(Item.name.contains(name_filter, autoescape = True))
+
+	if sort == 'id':
+		if after is not None:
+			query = query.filter(Item.id < after[1] if descending else Item.id > after[1])
+		return query.order_by(Item.id.desc() if descending else Item.id).limit(limit).all()
+
+	if after is not None:
+		query = query.filter(keyset_filter(column, after[0], after[1], descending))
+
+	if descending:
+		query = query.order_by(column.desc(), Item.id.desc())
+	else:
+		query = query.order_by(column, Item.id)
+	return query.limit(limit).all()
+
+def query_room_rows(owner_id, after = 0, limit = API_PAGE_SIZE):
+	# Return one page of a user's rooms as lightweight rows, keyed on Room.id
+	return session.query(Room.id, Room.name, User.name.label("owner")).\
+		join(User, Room.user_id == User.id).\
+		filter(Room.user_id == owner_id, Room.id > after).\
+		order_by(Room.id).limit(limit).all()
+
+def query_item_rows(room_id, after = 0, limit = API_PAGE_SIZE):
+	# Return one page of a room's items as lightweight rows, keyed on Item.id
+	return session.query(Item.id, Item.name, User.name.label("owner"),
+		Room.name.label("room"), Item.description, Item.price).\
+		join(User, Item.user_id == User.id).\
+		join(Room, Item.room_id == Room.id).\
+		filter(Item.room_id == room_id, Item.id > after).\
+		order_by(Item.id).limit(limit).all()
+
+def query_user_item_rows(owner_id, after = (0, 0), limit = API_PAGE_SIZE):
+	# Return one page of the items in all rooms of a user as lightweight
+	# rows, sorted and keyed on (room_id, id). Sorting on Room.id (equal to
+	# Item.room_id) lets SQLite walk the user's rooms and their (room_id, id)
+	# index in order instead of sorting all remaining items for every page.
+	after_room_id, after_id = after
+	return session.query(Item.id, Item.name, User.name.label("owner"),
+		Room.name.label("room"), Item.description, Item.price, Item.room_id).\
+		join(User, Item.user_id == User.id).\
+		join(Room, Item.room_id == Room.id).\
+		filter(Room.user_id == owner_id, or_(Item.room_id > after_room_id,
+			and_(Item.room_id == after_room_id, Item.id > after_id))).\
+		order_by(Room.id, Item.id).limit(limit).all()
+
+def next_cursor(rows, limit):
+	# Return the keyset cursor of the next page, or None on the last page
+	if len(rows) < limit:
+		return None
+	return rows[-1].id
+
+def get_page_args():
+	# Read the "after" cursor and the page size from the query string
+	after = request.args.get("after", 0, type = int)
+	limit = request.args.get("limit", API_PAGE_SIZE, type = int)
+	return after, min(max(limit, 1), API_MAX_PAGE_SIZE)
+
+# Ranked search of a user's items in the item_fts index. The user is
+# matched inside the index (see search_query), and bm25 gives the user_id
+# column no weight so that only name and description rank the results.
+SEARCH_SQL = text("""
+	SELECT item.id, item.name, item.description, item.price,
+		item.room_id, room.name AS room
+	FROM item_fts
+	JOIN item ON item.id = item_fts.rowid
+	JOIN room ON room.id = item.room_id
+	WHERE item_fts MATCH :match
+	ORDER BY bm25(item_fts, 1.0, 1.0, 0.0)
+	LIMIT :limit OFFSET :offset""")
+
+def search_query(owner_id, words):
+	# Turn the user's input into an FTS5 query matching the user's items with
+	# every word as a prefix of their name or description, or None if the
+	# input holds no words
+	words = re.findall(r"\w+", words)
+	if not words:
+		return None
+	return 'user_id : "{}" AND {{name description}} : ({})'.format(int(owner_id),
+		" ".join('"{}"*'.format(word) for word in words))
+
+def search_items(owner_id, words, page = 1, per_page = SEARCH_PAGE_SIZE):
+	# Return one page of the user's items matching the words, best match
+	# first, and whether there is a next page. Uses the item_fts index.
+	match = search_query(owner_id, words)
+	if not match:
+		return [], False
+
+	rows = session.execute(SEARCH_SQL, {'match': match,
+		'limit': per_page + 1, 'offset': (page - 1) * per_page}).fetchall()
+
+	return rows[:per_page], len(rows) > per_page
+
+def json_error(message, status):
+	# Return a JSON-encoded error message with the given status code
+	response = make_response(json.dumps(message), status)
+	response.headers['content-type'] = 'application/json'
+	return response
 
 def createUser(login_session):
 	# Create new user based on user's information stored in login_session
@@ -76,67 +399,133 @@ def getUserID(email):
 	except:
 		return None
 
+# Identity and access control
+def get_current_user_id():
+	# Return the id of the user that is currently logged in, or None.
+	# The id stored by gconnect is trusted; the email lookup is only a fallback
+	# for older sessions, and either way it is resolved once per request.
+	if "user_id" not in g:
+		user_id = None
+		if login_session.get("email"):
+			user_id = login_session.get("user_id")
+			if user_id is None:
+				user_id = getUserID(login_session["email"])
+				login_session["user_id"] = user_id
+		g.user_id = user_id
+	return g.user_id
+
+def login_required(action):
+	# Decorator redirecting to /login if user is not logged in
+	def decorator(f):
+		@wraps(f)
+		def decorated_function(*args, **kwargs):
+			if get_current_user_id() is None:
+				flash("Please log in to {}".format(action))
+				return redirect(url_for("login"))
+			return f(*args, **kwargs)
+		return decorated_function
+	return decorator
+
+def owner_required(login_action, denied_action):
+	# Decorator for routes on a room (and optionally one of its items).
+	# Checks that the room (and item) exist, that the user is logged in and
+	# that he/she owns the room, then passes the loaded room (and item) on.
+	def decorator(f):
+		@wraps(f)
+		def decorated_function(room_id, **kwargs):
+			# Check if room_id exists
+			room = get_room_from_id(room_id)
+			if not room:
+				return "No room found for room id: {}".format(room_id)
+
+			# Redirect to /login if user is not logged in
+			if get_current_user_id() is None:
+				flash("Please log in to {}".format(login_action))
+				return redirect(url_for("login"))
+
+			# Only allow access to owner of the room
+			if g.user_id != room.user_id:
+				return "You do not have permission to {}!".format(denied_action)
+
+			if "item_id" in kwargs:
+				item_id = kwargs["item_id"]
+
+				# Check if the item actually exists
+				item = get_item_from_id(item_id)
+				if not item:
+					return "No item found for item id: {}".format(item_id)
+
+				# Check if the item belongs to the room of id: room_id
+				if item.room_id != room.id:
+					return "{} (item-id: {}) does not belong to {} (room-id: {})".format(item.name,
+						item.id, room.name, room.id)
+				kwargs["item"] = item
+
+			return f(room_id = room_id, room = room, **kwargs)
+		return decorated_function
+	return decorator
+
+def api_login_required(f):
+	# Decorator answering 401 to API calls from users that are not logged in
+	@wraps(f)
+	def decorated_function(*args, **kwargs):
+		if get_current_user_id() is None:
+			return json_error("Please log in at {} to get access to the API".format(url_for('login')), 401)
+		return f(*args, **kwargs)
+	return decorated_function
+
+def rate_limit_key():
+	# Rate limits apply per user, or per IP address to anonymous clients
+	user_id = get_current_user_id()
+	if user_id is not None:
+		return "user:{}".format(user_id)
+	return "ip:{}".format(request.remote_addr)
+
+# Rate limits and concurrency caps of the endpoints (see ratelimit.py);
+# create_app() sets the bucket store and the limits from the settings
+limiter = Limiter(None, rate_limit_key, json_error, exempt = ('static', 'health', 'debugStats'))
+profiler.add_stats_provider("rate_limiter", limiter.stats)
+
 # Main routes
 @app.route('/')
 @app.route('/rooms/')
+@conditional
 def allRooms():
 	# Show all rooms
 
-	# Get all Room instances that belong to the user
-	rooms = get_rooms()
+	rooms_html = ""
+	if get_current_user_id() is not None:
+		# All rooms of the user with their item count and total value
+		rooms_html = render_fragment(("roomgrid",), "roomgrid.html",
+			lambda: dict(rooms = get_rooms()))
 
-	return render_template("rooms.html", rooms = rooms, login_session = login_session)
+	return render_template("rooms.html", rooms_html = rooms_html,
+		login_session = login_session)
 
 
 @app.route('/room/add/', methods = ['GET','POST'])
+@login_required("add room")
 def addRoom():
 	# Add new room
 
-	# Redirect to /login if user is not logged in
-	if not login_session.get("username"):
-		flash("Please log in to add room")
-		return(redirect(url_for("login")))
-
-	rooms = get_rooms() # for constructing left-side bar
-
 	if request.method == "POST":
 		name = request.form['name']
 		if not name:
 			return "You must fill in room's name"
-		new_room = Room(name = name, user_id = getUserID(login_session["email"]))
+		new_room = Room(name = name, user_id = g.user_id)
 		session.add(new_room)
-		session.commit()
+		commit_changes()
 		flash("{} is added!".format(new_room.name))
 		return redirect(url_for("allRooms"))
 	else:
 		return render_template("addroom.html", title = "Add room",
-		room_id = None, rooms = rooms, room = None, login_session = login_session)
+		room_id = None, room = None, login_session = login_session)
 
 @app.route('/room/<int:room_id>/edit/', methods = ['GET','POST'])
-def editRoom(room_id):
+@owner_required("edit your rooms", "edit this room")
+def editRoom(room_id, room):
 	# Edit existing rooms
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-
-		flash("Please log in to edit your rooms")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to edit this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
 	if request.method == "POST":
 		name = request.form["name"]
 
@@ -144,7 +533,7 @@ def editRoom(room_id):
 			old_name = room.name
 			room.name = name
 			session.add(room)
-			session.commit()
+			commit_changes()
 
 			flash("{} has been renamed to {}".format(old_name, name))
 			return redirect(url_for("showItems", room_id = room_id))
@@ -152,51 +541,29 @@ def editRoom(room_id):
 			return "You must fill in room's name"
 	else:
 		return render_template("editroom.html", title = "Rename room",
-		room_id = room_id, rooms = rooms, room = room, login_session = login_session)
+		room_id = room_id, room = room, login_session = login_session)
 
 
 @app.route('/room/<int:room_id>/delete/')
-def deleteRoom(room_id):
+@primary_db
+@owner_required("delete your rooms", "delete this room")
+def deleteRoom(room_id, room):
 	# Delete existing rooms
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-		flash("Please log in to delete your rooms")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to delete this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
 	# Get query parameter
 	delete = request.args.get('delete')
 
 	if not delete:
 		return render_template("deleteroom.html", title = "Delete room",
-		rooms = rooms, room = room, login_session = login_session)
+		room = room, login_session = login_session)
 
 	if delete=="true":
-		# First delete all items within the room:
-		items = session.query(Item).filter_by(room_id = room.id).all()
-		for item in items:
-			session.delete(item)
-			session.commit()
-
-		# Then delete the room itself
+		# Delete all items within the room with one bulk DELETE, then the
+		# room itself, in a single transaction
 		name = room.name
+		session.query(Item).filter_by(room_id = room.id).delete(synchronize_session = False)
 		session.delete(room)
-		session.commit()
+		commit_changes()
 
 		flash("{} and all items within it have been removed!".format(name))
 		return redirect(url_for("allRooms"))
@@ -208,94 +575,65 @@ def deleteRoom(room_id):
 
 
 @app.route('/room/<int:room_id>/items/')
-def showItems(room_id):
+@owner_required("view your items", "view items in this room")
+@conditional
+def showItems(room_id, room):
 	# Show all items from an existing room
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-		flash("Please log in to view your items")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to view items in this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
-	items = session.query(Item).filter_by(room_id = room_id).all()
+	# Get sorting, filtering and paging parameters
+	sort = request.args.get("sort", "id")
+	if sort not in ITEM_SORT_COLUMNS:
+		sort = "id"
+	descending = request.args.get("order") == "desc"
+	name_filter = request.args.get("name", "")
+
+	after = None
+	after_id = request.args.get("after_id", type = int)
+	if after_id is not None:
+		after_value = request.args.get("after") or None
+		if sort == "price" and after_value is not None:
+			try:
+				after_value = int(after_value)
+			except ValueError:
+				return "Invalid value for after parameter: {}".format(after_value)
+		after = (after_value, after_id)
+
+	def items_table():
+		items = query_room_items(room_id, sort, descending, name_filter, after, ITEMS_PAGE_SIZE + 1)
+
+		# Parameters of the link to the next page
+		next_page = None
+		if len(items) > ITEMS_PAGE_SIZE:
+			items = items[:ITEMS_PAGE_SIZE]
+			last = items[-1]
+			next_page = {'after_id': last.id,
+				'after': {'id': last.id, 'name': last.name, 'price': last.price_cents}[sort]}
+
+		return dict(items = items, room_id = room_id, sort = sort, descending = descending,
+			name_filter = name_filter, after = after, next_page = next_page)
+
+	items_html = render_fragment(("itemstable", room_id, sort, descending, name_filter, after),
+		"itemstable.html", items_table)
 
 	return render_template("items.html", title = "Items in {}".format(room.name),
-	items = items, length = len(items), room_id = room_id,
-	rooms = rooms, room = room, login_session = login_session)
+	items_html = items_html, room_id = room_id, sort = sort, descending = descending,
+	name_filter = name_filter, room = room, rooms = get_rooms(), login_session = login_session)
 
 @app.route('/room/<int:room_id>/items/<int:item_id>/')
-def showSingleItem(room_id, item_id):
+@owner_required("view your items", "view items in this room")
+@conditional
+def showSingleItem(room_id, item_id, room, item):
 	# Show a single item
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-		flash("Please log in to view your items")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to view items in this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
-	item = session.query(Item).filter_by(id = item_id).one()
-
-	# Check if the item actually belongs to the room
-	if item.room_id != room.id:
-		return "{} (item-id: {}) does not belong to {} (room-id: {})".format(item.name,
-			item.id, room.name, room.id)
-
 	return render_template("item.html", title = item.name,
-		item = item, room_id = room_id, rooms = rooms, room = room, login_session = login_session)
+		item = item, room_id = room_id, room = room, login_session = login_session)
 
 
 @app.route('/room/<int:room_id>/items/add/', methods = ['GET','POST'])
-def addItem(room_id):
+@owner_required("add new items", "add items to this room")
+def addItem(room_id, room):
 	# Add a new item to an existing room
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-		flash("Please log in to add new items")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to add items to this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
 	if request.method == "POST":
 		name = request.form["name"]
 		if not name:
@@ -305,52 +643,23 @@ def addItem(room_id):
 		price = request.form["price"]
 
 		new_item = Item(name = name, description = description,
-			price = price, room_id = room_id, user_id = user_id)
+			price = price, room_id = room_id, user_id = g.user_id)
 
 		session.add(new_item)
-		session.commit()
+		commit_changes()
 
 		flash("{} is added to {}!".format(name, room.name))
 		return redirect(url_for("showItems", room_id = room_id))
 
 	else:
 		return render_template("additem.html", title = "Add new item to {}".format(room.name),
-			room_id = room_id, rooms = rooms, room = room, login_session = login_session)
+			room_id = room_id, room = room, login_session = login_session)
 
 @app.route('/room/<int:room_id>/items/<int:item_id>/edit/', methods = ["GET", "POST"])
-def editItem(room_id, item_id):
+@owner_required("edit your items", "edit item in this room")
+def editItem(room_id, item_id, room, item):
 	# Edit an existing item
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-		flash("Please log in to edit your items")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to edit item in this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
-	# Check if the item actually exists
-	item = get_item_from_id(item_id)
-	if not item:
-		return "Item id {} does not exist".format(item_id)
-
-	# Check if the item belongs to the room of id: room_id
-	if item.room_id != room.id:
-		return "{} (item-id: {}) does not belong to {} (room-id: {})".format(item.name,
-			item.id, room.name, room.id)
-
 	if request.method == "POST":
 		name = request.form["name"]
 		if name:
@@ -362,59 +671,31 @@ def editItem(room_id, item_id):
 		item.price = request.form["price"]
 
 		session.add(item)
-		session.commit()
+		commit_changes()
 
 		flash("Item edited!")
 		return redirect(url_for("showItems", room_id = room_id))
 
 	return render_template("edititem.html", title = "Edit item", item = item,
-		room_id = room_id, rooms = rooms, room = room, login_session = login_session)
+		room_id = room_id, room = room, login_session = login_session)
 
 @app.route('/room/<int:room_id>/items/<int:item_id>/delete/')
-def deleteItem(room_id, item_id):
+@primary_db
+@owner_required("delete your items", "delete item in this room")
+def deleteItem(room_id, item_id, room, item):
 	# Delete an existing item
 
-	# Check if room_id exists
-	room = get_room_from_id(room_id)
-	if not room:
-		return "No room found for room id: {}".format(room_id)
-
-	# Redirect to /login if user is not logged in
-	email = login_session.get("email")
-	if not email:
-		flash("Please log in to delete your items")
-		return(redirect(url_for("login")))
-
-	# Get current user id:
-	user_id = getUserID(email)
-
-	# Only allow access to owner of the room
-	if user_id != room.user_id:
-		return "You do not have permission to delete item in this room!"
-
-	rooms = get_rooms() # for constructing left-side bar
-
-	# Check if the item actually exists
-	item = get_item_from_id(item_id)
-	if not item:
-		return "No item found for room id: {}".format(item_id)
-
-	# Check if the item belongs to the room of id: room_id
-	if item.room_id != room.id:
-		return "{} (item-id: {}) does not belong to {} (room-id: {})".format(item.name,
-			item.id, room.name, room.id)
-
 	# Get query parameter
 	delete = request.args.get('delete')
 
 	if not delete:
 		return render_template("deleteitem.html", title = "Delete item",
-		item = item, rooms = rooms, room = room, login_session = login_session)
+		item = item, room = room, login_session = login_session)
 
 	if delete == "true":
 		flash("{} has been removed from {}".format(item.name, room.name))
 		session.delete(item)
-		session.commit()
+		commit_changes()
 		return redirect(url_for("showItems", item_id = item_id, room_id = room_id))
 
 	elif delete=="false":
@@ -425,6 +706,21 @@ def deleteItem(room_id, item_id):
 		return "Invalid value for delete parameter: {}".format(delete)
 
 
+@app.route('/search/')
+@login_required("search your items")
+@conditional
+def searchItems():
+	# Show the user's items matching the words in ?q=, e.g. /search/?q=lamp
+
+	words = request.args.get("q", "")
+	page = max(request.args.get("page", 1, type = int), 1)
+	items, has_next = search_items(g.user_id, words, page)
+
+	return render_template("search.html", title = "Search results for \"{}\"".format(words),
+		items = items, q = words, page = page, has_next = has_next,
+		room_id = None, room = None, login_session = login_session)
+
+
 # Log-in and Log-out
 @app.route('/login')
 @app.route('/login/')
@@ -434,7 +730,8 @@ def login():
 	# Store it in the session for later validation
 	login_session['state'] = state
 
-	return render_template("login.html", STATE = state, login_session = login_session)
+	return render_template("login.html", STATE = state, CLIENT_ID = client_secrets.client_id,
+		login_session = login_session)
 
 #Handling browser' resquests regarding Google API authentication
 @app.route('/gconnect', methods=['POST'])
@@ -451,30 +748,29 @@ def gconnect():
 	try:
 		# Upgrade the authorization code into a credentials object
 
-		# Create a flow object from the key information in client_secrets.json
-		oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
-		oauth_flow.redirect_uri = 'postmessage'
+		# Get the flow object built from the key information in client_secrets.json
+		oauth_flow = client_secrets.get_flow()
 
 		# Exchange authorization code for credential object
 		# Credential object returned by Google API will be stored as a variable
-		credentials = oauth_flow.step2_exchange(code)
+		credentials = oauth_http.exchange_code(oauth_flow, code)
 
 	except FlowExchangeError:
-		response = make_response(json.dump('Failed to upgrade the authorization code.'), 401)
+		response = make_response(json.dumps('Failed to upgrade the authorization code.'), 401)
 		response.headers['content-type'] = 'application/json'
 		return response
 
 	# Check that the access token (inside credential object) is valid
 	access_token = credentials.access_token
-		# Google API will help you verify the access token
-	url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s' % access_token)
-	h = httplib2.Http()
-	result = json.loads(h.request(url, 'GET')[1].decode())
+		# Google API will help you verify the access token, and tell who the
+		# user is; both calls run concurrently on the shared connection pool
+	result, data = oauth_http.fetch_token_details(access_token)
 
 	# If there was an error in the access token info, abort.
 	if result.get('error') is not None:
 		response = make_response(json.dumps(result.get('error')), 500)
-		response.headers['content-type'] = 'applicatin/json'
+		response.headers['content-type'] = 'application/json'
+		return response
 
 	# Verify that the access token is used for the intended user
 	gplus_id = credentials.id_token['sub']
@@ -485,8 +781,8 @@ def gconnect():
 		return response
 
 	# Verify that the access token is valid for this app.
-	if result['issued_to'] != CLIENT_ID:
-		response = make_response(json.dump("Token's client ID does not match app's."), 401)
+	if result['issued_to'] != client_secrets.client_id:
+		response = make_response(json.dumps("Token's client ID does not match app's."), 401)
 		print("Token's client ID does not match app's.")
 		response.headers["content-type"] = "application/json"
 		return response
@@ -502,23 +798,21 @@ def gconnect():
 	login_session['credentials'] = credentials.to_json()
 	login_session['gplus_id'] = gplus_id
 
-	# Get user info
-	userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-	params = {'access_token': credentials.access_token, 'alt': 'json'}
-	answer = requests.get(userinfo_url, params = params)
-
-	data = answer.json()
-
+	# Store user info
 	login_session["provider"] = "google"
 	login_session['username'] = data['name']
 	login_session['picture'] = data['picture']
 	login_session['email'] = data['email']
 
 	# If this is the first log in, create a new user in the database
-	if getUserID(login_session['email']) == None:
-		login_session['user_id'] = createUser(login_session)
-	else:
-		login_session['user_id'] = getUserID(login_session['email'])
+	user_id = getUserID(login_session['email'])
+	if user_id == None:
+		user_id = createUser(login_session)
+	login_session['user_id'] = user_id
+
+	# Move a server-side session to a new id now that it is logged in
+	if hasattr(login_session, 'regenerate'):
+		login_session.regenerate()
 
 	output = '''
 			<h1>Login successful! Welcome, {}!</h1>
@@ -539,11 +833,8 @@ def logout():
 
 	# Execute HTTP GET request to revoke current token
 	access_token = json.loads(credentials).get("access_token")
-	url = "https://accounts.google.com/o/oauth2/revoke?token=%s" %access_token
-	h = httplib2.Http()
-	result = h.request(url, 'GET')[0]
 
-	if result['status'] == '200':
+	if oauth_http.revoke_token(access_token):
 		# Reset the user's session.
 		del login_session['credentials']
 		del login_session['gplus_id']
@@ -551,6 +842,7 @@ def logout():
 		del login_session['email']
 		del login_session['picture']
 		del login_session['provider']
+		login_session.pop('user_id', None)
 
 		response = make_response(json.dumps("Successfully disconnected."), 200)
 		response.headers["content-type"] = "application/json"
@@ -563,30 +855,375 @@ def logout():
 
 # API End-points:
 @app.route('/JSON')
+@api_login_required
+@conditional
 def JSON():
-	# Return information about rooms and their items in JSON format
+	# Return information about rooms and their items in JSON format.
+	# ?format=columnar lists the field names once and every room and item
+	# as an array, which is much smaller for large inventories.
 
-	# Check if the user is logged in
-	if not login_session.get("username"):
-		response = make_response(json.dumps("Please log in at {} to get access to the API".format(url_for('login'))), 401)
-		response.headers['content-type'] = 'application/json'
+	layout = request.args.get("format", "nested")
+	if layout not in serialization.LAYOUTS:
+		return json_error("Please specify format: one of {}".format(", ".join(serialization.LAYOUTS)), 400)
+
+	export = serialization.export_rooms(session.connection(), g.user_id, layout)
+	return Response(serialization.dumps(export), mimetype = "application/json")
+
+@app.route('/api/rooms')
+@app.route('/api/rooms/')
+@api_login_required
+@conditional
+def apiRooms():
+	# Return one page of the user's rooms, e.g. /api/rooms?after=<id>&limit=<n>
+
+	after, limit = get_page_args()
+	rows = query_room_rows(g.user_id, after, limit)
+
+	return jsonify(Rooms = [row._asdict() for row in rows], next = next_cursor(rows, limit))
+
+@app.route('/api/rooms/<int:room_id>/items')
+@app.route('/api/rooms/<int:room_id>/items/')
+@api_login_required
+@conditional
+def apiItems(room_id):
+	# Return one page of the items in a room, e.g. /api/rooms/1/items?after=<id>
+
+	# Check if room_id exists
+	room = get_room_from_id(room_id)
+	if not room:
+		return json_error("No room found for room id: {}".format(room_id), 404)
+
+	# Only allow access to owner of the room
+	if g.user_id != room.user_id:
+		return json_error("You do not have permission to view items in this room!", 403)
+
+	after, limit = get_page_args()
+	rows = query_item_rows(room_id, after, limit)
+
+	return jsonify(Items = [row._asdict() for row in rows], next = next_cursor(rows, limit))
+
+@app.route('/api/export')
+@app.route('/api/export/')
+@api_login_required
+@conditional
+def apiExport():
+	# Stream every room and item of the user as newline-delimited JSON.
+	# Each line is one record: a room is followed by all of its items.
+	# Rooms and all of the user's items are read in keyset pages, both in
+	# room order, and merged; memory stays flat for any inventory size and
+	# the number of queries does not depend on the number of rooms.
+
+	owner_id = g.user_id
+
+	def rooms():
+		after = 0
+		while after is not None:
+			rows = query_room_rows(owner_id, after, API_MAX_PAGE_SIZE)
+			for row in rows:
+				yield row
+			after = next_cursor(rows, API_MAX_PAGE_SIZE)
+
+	def items():
+		after = (0, 0)
+		while after is not None:
+			rows = query_user_item_rows(owner_id, after, API_MAX_PAGE_SIZE)
+			for row in rows:
+				yield row
+			after = (rows[-1].room_id, rows[-1].id) if len(rows) == API_MAX_PAGE_SIZE else None
+
+	def generate():
+		item_rows = items()
+		item = next(item_rows, None)
+		for room in rooms():
+			yield serialization.dumps(dict(room._asdict(), type = "room")) + b"\n"
+			# Skip the items of a room deleted while streaming
+			while item is not None and item.room_id <= room.id:
+				if item.room_id == room.id:
+					record = item._asdict()
+					del record['room_id']
+					yield serialization.dumps(dict(record, type = "item")) + b"\n"
+				item = next(item_rows, None)
+
+	return Response(stream_with_context(generate()), mimetype = "application/x-ndjson")
+
+@app.route('/api/import', methods = ['POST'])
+@app.route('/api/import/', methods = ['POST'])
+@api_login_required
+def apiImport():
+	# Import rooms and items from an uploaded CSV, JSON or NDJSON file.
+	# The file is sent as the "file" field of a multipart form or as the raw
+	# request body; ?format=csv|json|ndjson and ?batch_size=<n> are optional.
+
+	upload = request.files.get("file")
+	file_format = request.args.get("format") or \
+		importer.guess_format(upload.filename if upload else None)
+	if file_format not in importer.FORMATS:
+		return json_error("Please specify format: one of {}".format(", ".join(importer.FORMATS)), 400)
+
+	batch_size = request.args.get("batch_size", importer.DEFAULT_BATCH_SIZE, type = int)
+	if batch_size < 1:
+		return json_error("batch_size must be a positive number", 400)
+
+	if upload:
+		fileobj = io.TextIOWrapper(upload.stream, encoding = "utf-8", newline = "")
+	else:
+		fileobj = io.StringIO(request.get_data(as_text = True), newline = "")
+
+	# Every batch is committed with a bump of the user's revision (see
+	# importer.import_records); a file that cannot be read further only rolls
+	# back the current batch. If earlier batches were committed, the answer
+	# is 207 with the report of what was imported and the error.
+	report = importer.import_records(session, g.user_id,
+		importer.iter_records(fileobj, file_format), batch_size)
+	if 'error' in report:
+		report['error'] = "Could not read the {} file: {}".format(file_format, report['error'])
+		if not report['rooms_created'] and not report['items_imported']:
+			return json_error(report['error'], 400)
+		return jsonify(report), 207
+
+	return jsonify(report)
+
+
+@app.route('/api/search')
+@app.route('/api/search/')
+@api_login_required
+@conditional
+def apiSearch():
+	# Return one page of the user's items matching ?q=, best match first
+
+	page = max(request.args.get("page", 1, type = int), 1)
+	items, has_next = search_items(g.user_id, request.args.get("q", ""), page)
+
+	return jsonify(Items = [item._asdict() for item in items],
+		next = page + 1 if has_next else None)
+
+@app.route('/api/items')
+@app.route('/api/items/')
+@api_login_required
+@conditional
+def apiItemsByPrice():
+	# Return one page of the user's items sorted by price, e.g.
+	# /api/items?min_price=10&max_price=99.99&sort=-price&room_id=1
+	# Pass the "next" value of a response as ?after= to get the next page.
+
+	descending = request.args.get("sort", "price") == "-price"
+	room_id = request.args.get("room_id", type = int)
+	min_cents = parse_price(request.args.get("min_price"))[0]
+	max_cents = parse_price(request.args.get("max_price"))[0]
+
+	after = None
+	if request.args.get("after"):
+		try:
+			after = tuple(int(n) for n in request.args["after"].split(","))
+		except ValueError:
+			return json_error("Invalid value for after parameter", 400)
+		if len(after) != 2:
+			return json_error("Invalid value for after parameter", 400)
+
+	limit = get_page_args()[1]
+	rows = query_items_by_price(g.user_id, room_id, min_cents, max_cents,
+		descending, after, limit)
+
+	next_page = None
+	if len(rows) == limit:
+		next_page = "{},{}".format(rows[-1].price_cents, rows[-1].id)
+
+	return jsonify(Items = [row._asdict() for row in rows], next = next_page)
+
+@app.route('/api/items/batch', methods = ['POST'])
+@app.route('/api/items/batch/', methods = ['POST'])
+@api_login_required
+def apiItemsBatch():
+	# Apply a JSON list of item operations in one transaction, e.g.
+	# {"operations": [{"op": "move", "id": 5, "room_id": 2}, {"op": "delete", "id": 6}]}
+	# (see batch.py). Nothing is applied if one operation is invalid; the
+	# response reports the outcome of each operation.
+
+	body = request.get_json(silent = True)
+	operations = body.get("operations") if isinstance(body, dict) else body
+	if not isinstance(operations, list):
+		return json_error("Please send a JSON list of operations", 400)
+
+	try:
+		applied, results = batch.apply_operations(session, g.user_id, operations)
+	except ValueError as e:
+		return json_error(str(e), 400)
+
+	if not applied:
+		session.rollback()
+		response = jsonify(applied = False, results = results)
+		response.status_code = 422
 		return response
 
-	# Get all Room instances that belong the currently logged-in user
-	rooms = session.query(Room).filter_by(user_id = getUserID(login_session["email"])).all()
+	commit_changes()
+	return jsonify(applied = True, results = results)
 
-	# Constructing the object to put in to JSON file
-	rooms_list = []
-	for room in rooms:
-		items = session.query(Item).filter_by(room_id = room.id).all()
-		items_list = [item.serialize for item in items]
-		room_dictionary = deepcopy(room.serialize)
-		room_dictionary["items"] = items_list
-		rooms_list += [room_dictionary]
+@app.route('/api/totals')
+@app.route('/api/totals/')
+@api_login_required
+@conditional
+def apiTotals():
+	# Return item count and total value per room and for the whole user
 
-	return jsonify(Rooms = rooms_list)
+	rooms_list = []
+	user_totals = {'items': 0, 'totals': {}}
+	for room in get_rooms():
+		rooms_list.append(dict(id = room.id, name = room.name, items = room.items, totals = room.totals))
+		user_totals['items'] += room.items
+		for currency, cents in room.totals.items():
+			user_totals['totals'][currency] = user_totals['totals'].get(currency, 0) + cents
+
+	return jsonify(Rooms = rooms_list, **user_totals)
+
+@app.route('/api/changes')
+@app.route('/api/changes/')
+@api_login_required
+def apiChanges():
+	# Return the changes to the user's rooms and items after a cursor, in
+	# order, e.g. /api/changes?since=<cursor>&limit=<n>. Each change carries
+	# the current data of its room or item (null once deleted); clients
+	# should apply "insert" and "update" alike. Without ?since= only the
+	# current cursor is returned, to be stored before a full /JSON download.
+
+	latest = session.query(func.max(Change.id)).filter(Change.user_id == g.user_id).scalar() or 0
+	purged_up_to = session.query(ChangeLogState.purged_up_to).filter_by(id = 1).scalar() or 0
+
+	since = request.args.get("since", type = int)
+	if since is None:
+		# Once retention removed all of the user's changes, start after the
+		# purged ones, so the cursor handed out has not already expired
+		return jsonify(changes = [], cursor = max(latest, purged_up_to), more = False)
+
+	# Changes older than the retention period are gone: resynchronize
+	if since < purged_up_to:
+		return json_error("Cursor {} has expired, please download /JSON again".format(since), 410)
+
+	limit = get_page_args()[1]
+	changes = session.query(Change).filter(Change.user_id == g.user_id, Change.id > since).\
+		order_by(Change.id).limit(limit).all()
+
+	# Current data of the changed rooms and items, two queries per page
+	room_ids = set(c.entity_id for c in changes if c.entity == "room")
+	item_ids = set(c.entity_id for c in changes if c.entity == "item")
+	data = {}
+	if room_ids:
+		for row in session.query(Room.id, Room.name).filter(Room.id.in_(room_ids)):
+			data[("room", row.id)] = row._asdict()
+	if item_ids:
+		for row in session.query(Item.id, Item.name, Item.description, Item.price,
+				Item.room_id).filter(Item.id.in_(item_ids)):
+			data[("item", row.id)] = row._asdict()
+
+	changes_list = [{
+		'id'        : c.id,
+		'entity'    : c.entity,
+		'entity_id' : c.entity_id,
+		'room_id'   : c.room_id,
+		'action'    : c.action,
+		'data'      : data.get((c.entity, c.entity_id)),
+	} for c in changes]
+
+	cursor = changes[-1].id if changes else since
+	return jsonify(changes = changes_list, cursor = cursor, more = cursor < latest)
+
+@app.route('/health')
+def health():
+	# Readiness and liveness check for load balancers and process managers:
+	# 200 once the app is warmed up and the database answers, 503 otherwise
+	try:
+		session.execute(text("SELECT 1"))
+		database = "ok"
+	except Exception as e:
+		database = "error: {}".format(e.__class__.__name__)
+	ready = warmed_up and database == "ok"
+	response = jsonify(status = "ok" if ready else "unavailable", database = database,
+		warmed_up = warmed_up, pid = os.getpid())
+	response.status_code = 200 if ready else 503
+	response.headers['Cache-Control'] = "no-store"
+	return response
+
+def warm_up():
+	# Do the work of the first requests before accepting traffic: compile
+	# all templates, open a database connection and load the room lists of
+	# the most recently active users into rooms_cache
+	global warmed_up
+	for name in app.jinja_env.list_templates():
+		app.jinja_env.get_template(name)
+
+	with app.app_context():
+		users = session.query(User.id, User.revision).\
+			order_by(User.updated_at.desc()).limit(app.config['WARM_UP_USERS']).all()
+		for user_id, revision in users:
+			rooms_cache.set((user_id, revision or 0), load_rooms(user_id))
+	warmed_up = True
+
+def dispose_engines():
+	# A worker forked from a process that already connected (e.g. gunicorn
+	# --preload) must not reuse the parent's connections: it starts with
+	# empty pools and opens its own
+	for db_engine in (engine, replica_engine, getattr(limiter.store, 'engine', None)):
+		if db_engine is not None:
+			db_engine.dispose(close = False)
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child = dispose_engines)
+
+def create_app(config = None):
+	# Load the app settings (Config, the APP_SETTINGS file, then the config
+	# dictionary), connect to the database and warm up. Return the app.
+	# It can be called again with other settings (e.g. by tests): the
+	# previous connections are closed and the extensions only reload their
+	# settings, their hooks are registered once.
+	global engine, replica_engine, client_secrets, warmed_up
+	session.remove()
+	for db_engine in (engine, replica_engine, getattr(limiter.store, 'engine', None)):
+		if db_engine is not None:
+			db_engine.dispose()
+
+	app.config.from_object(Config)
+	app.config.from_envvar('APP_SETTINGS', silent = True)
+	if config:
+		app.config.from_mapping(config)
+
+	engine = create_db_engine(app.config['DATABASE_URL'], app.config)
+	replica_engine = None
+	if app.config['DATABASE_REPLICA_URL']:
+		replica_engine = create_db_engine(app.config['DATABASE_REPLICA_URL'], app.config, read_only = True)
+	Base.metadata.bind = engine
+	session.configure(bind = engine, info = {'replica': replica_engine})
+
+	# Keep login_session server side so the cookie only carries its id
+	if app.config['SESSION_BACKEND'] == 'sql':
+		app.session_interface = ServerSessionInterface(SQLStore(engine))
+	elif app.config['SESSION_BACKEND'] == 'memory':
+		app.session_interface = ServerSessionInterface(MemoryStore())
+	else:
+		app.session_interface = SecureCookieSessionInterface()
+
+	# Take the client address and scheme from the headers of trusted proxies
+	if isinstance(app.wsgi_app, ProxyFix):
+		app.wsgi_app = app.wsgi_app.app
+	hops = app.config['TRUSTED_PROXY_HOPS']
+	if hops:
+		app.wsgi_app = ProxyFix(app.wsgi_app, x_for = hops, x_proto = hops)
+
+	client_secrets = ClientSecrets(app.config['CLIENT_SECRETS_FILE'])
+	profiler.init_app(app)
+
+	# Rate limits and concurrency caps, with buckets shared by the workers
+	# unless RATE_LIMIT_STORE is "memory"
+	if app.config['RATE_LIMIT_STORE'] == 'memory':
+		limiter.store = MemoryBucketStore()
+	else:
+		limiter.store = SQLBucketStore(create_db_engine(app.config['RATE_LIMIT_STORE'], app.config))
+	limiter.init_app(app)
+	if app.config['WARM_UP']:
+		warm_up()
+	else:
+		warmed_up = True
+	return app
 
 if __name__ == '__main__':
-  app.secret_key = 'super_secret_key'
-  app.debug = True
-  app.run(host = '0.0.0.0', port = 5000)
\ No newline at end of file
+  create_app()
+  client_secrets.watch_signal()
+  app.run(host = app.config['HOST'], port = app.config['PORT'])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Outbound HTTP calls to Google's OAuth 2.0 endpoints.
+#
+# All calls share one keep-alive connection pool with timeouts and retries
+# instead of opening a new TLS connection per call. Calls are made on the
+# request's own thread; only the independent tokeninfo and userinfo calls of
+# a login run side by side, on a bounded worker pool.
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Google endpoints; point them at a local stub server for testing
+TOKENINFO_URL = "https://www.googleapis.com/oauth2/v1/tokeninfo"
+USERINFO_URL = "https://www.googleapis.com/oauth2/v1/userinfo"
+REVOKE_URL = "https://accounts.google.com/o/oauth2/revoke"
+
+TIMEOUT = 10 # seconds before an outbound call is abandoned
+RETRIES = 2 # retries of failed connections and 5xx answers
+POOL_SIZE = 32 # keep-alive connections kept per host
+WORKERS = 16 # tokeninfo and userinfo calls running at the same time
+
+http_adapter = HTTPAdapter(pool_maxsize = POOL_SIZE,
+	max_retries = Retry(total = RETRIES, backoff_factor = 0.2, status_forcelist = (500, 502, 503, 504)))
+http_session = requests.Session()
+http_session.mount("https://", http_adapter)
+http_session.mount("http://", http_adapter)
+
+executor = ThreadPoolExecutor(max_workers = WORKERS)
+
+_local = threading.local()
+
+
+def get_http():
+	# Return this thread's httplib2.Http for oauth2client, which keeps its
+	# connections open between calls; Http objects are not thread-safe
+	if not hasattr(_local, "http"):
+		_local.http = httplib2.Http(timeout = TIMEOUT)
+	return _local.http
+
+def exchange_code(oauth_flow, code):
+	# Exchange an authorization code for a credentials object
+	return oauth_flow.step2_exchange(code, http = get_http())
+
+def get_tokeninfo(access_token):
+	# Return the information Google has about an access token
+	return http_session.get(TOKENINFO_URL, params = {'access_token': access_token},
+		timeout = TIMEOUT).json()
+
+def get_userinfo(access_token):
+	# Return the profile (name, email, picture) of the token's owner
+	return http_session.get(USERINFO_URL, params = {'access_token': access_token, 'alt': 'json'},
+		timeout = TIMEOUT).json()
+
+def fetch_token_details(access_token):
+	# Return (tokeninfo, userinfo) of an access token, fetched concurrently
+	tokeninfo = executor.submit(get_tokeninfo, access_token)
+	userinfo = executor.submit(get_userinfo, access_token)
+	return tokeninfo.result(), userinfo.result()
+
+def revoke_token(access_token):
+	# Revoke an access token; return True on success
+	response = http_session.get(REVOKE_URL, params = {'token': access_token}, timeout = TIMEOUT)
+	return response.status_code == 200
@@ -2,14 +2,14 @@
 
 # Populate the database with some test data
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from database_setup import Base, User, Room, Item
+from db import create_db_engine
 
 import json
 
-engine = create_engine('sqlite:///room_item_user.db')
+engine = create_db_engine()
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind = engine)
 session = DBSession()
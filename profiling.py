@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Per-request profiling of the Flask app.
+#
+# When app.config['PROFILING'] is set, every request records its number of
+# SQL queries, total SQL time, slowest statement, template render time and
+# wall time. The figures are sent back in a Server-Timing header and kept
+# as rolling per-endpoint statistics served at /_debug/stats. Statements
+# slower than app.config['SLOW_QUERY_MS'] are logged.
+#
+# /_debug/stats reveals SQL statements and traffic, so it answers 404 unless
+# app.config['DEBUG'] or app.config['DEBUG_STATS'] is set. It then requires
+# app.config['DEBUG_STATS_TOKEN'] in an X-Debug-Token header or, when no
+# token is set, a client on the loopback interface.
+
+from flask import abort, g, has_request_context, jsonify, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from collections import deque
+from threading import Lock
+import hmac
+import logging
+import time
+
+# Upper bounds (ms) of the request duration histogram buckets
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+
+slow_query_log = logging.getLogger("slow_queries")
+
+
+def percentile(sorted_values, fraction):
+	# Return the value at the given fraction of an already sorted list
+	if not sorted_values:
+		return None
+	index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+	return round(sorted_values[index], 3)
+
+
+class EndpointStats(object):
+	# Rolling statistics of one endpoint
+	def __init__(self, window):
+		self.count = 0
+		self.queries = 0
+		self.sql_ms = 0.0
+		self.total_ms = 0.0
+		self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+		self.recent = deque(maxlen = window)
+		self.slowest_query_ms = 0.0
+		self.slowest_query = None
+
+	def add(self, profile, total_ms):
+		self.count += 1
+		self.queries += profile['queries']
+		self.sql_ms += profile['sql_ms']
+		self.total_ms += total_ms
+		self.recent.append(total_ms)
+		if profile['slowest_ms'] > self.slowest_query_ms:
+			self.slowest_query_ms = profile['slowest_ms']
+			self.slowest_query = profile['slowest']
+		for i, bound in enumerate(HISTOGRAM_BUCKETS):
+			if total_ms <= bound:
+				self.histogram[i] += 1
+				break
+		else:
+			self.histogram[-1] += 1
+
+	def summary(self):
+		recent = sorted(self.recent)
+		labels = ["<={}ms".format(bound) for bound in HISTOGRAM_BUCKETS]
+		labels.append(">{}ms".format(HISTOGRAM_BUCKETS[-1]))
+		return {
+			'count'           : self.count,
+			'avg_ms'          : round(self.total_ms / self.count, 3),
+			'avg_queries'     : round(float(self.queries) / self.count, 2),
+			'avg_sql_ms'      : round(self.sql_ms / self.count, 3),
+			'p50_ms'          : percentile(recent, 0.50),
+			'p95_ms'          : percentile(recent, 0.95),
+			'p99_ms'          : percentile(recent, 0.99),
+			'histogram'       : dict(zip(labels, self.histogram)),
+			'slowest_query_ms': round(self.slowest_query_ms, 3),
+			'slowest_query'   : self.slowest_query,
+		}
+
+
+class Profiler(object):
+	# Hooks SQLAlchemy and Flask events to profile requests of an app.
+	# The app can be given later to init_app, once its settings are loaded.
+
+	def __init__(self, app = None, window = 1000):
+		self.app = app
+		self.window = window
+		self.enabled = False
+		self.slow_query_ms = None
+		self.endpoints = {}
+		self.stats_providers = {}
+		self._listening = False
+		self._lock = Lock()
+
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		# Load the settings of app.config. It may be called again with new
+		# settings: the hooks are only registered once per app.
+		self.app = app
+		self.enabled = bool(app.config.get('PROFILING'))
+		self.slow_query_ms = app.config.get('SLOW_QUERY_MS')
+
+		if self.enabled and not self._listening:
+			event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+			event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+			self._listening = True
+
+		if 'profiler' in app.extensions:
+			return
+		app.extensions['profiler'] = self
+		before_render_template.connect(self.before_render, app)
+		template_rendered.connect(self.after_render, app)
+		app.before_request(self.before_request)
+		app.after_request(self.after_request)
+		app.add_url_rule('/_debug/stats', 'debugStats', self.stats_view)
+
+	def add_stats_provider(self, name, provider):
+		# Register a callable whose result is included in /_debug/stats
+		self.stats_providers[name] = provider
+
+	# SQLAlchemy events
+	def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+		if self.enabled:
+			conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+	def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+		start_times = conn.info.get('query_start_time')
+		if not start_times:
+			return
+		elapsed_ms = (time.perf_counter() - start_times.pop()) * 1000
+
+		if self.slow_query_ms is not None and elapsed_ms > self.slow_query_ms:
+			slow_query_log.warning("%.1f ms: %s", elapsed_ms, statement)
+
+		if not has_request_context() or 'profile' not in g:
+			return
+		profile = g.profile
+		profile['queries'] += 1
+		profile['sql_ms'] += elapsed_ms
+		if elapsed_ms > profile['slowest_ms']:
+			profile['slowest_ms'] = elapsed_ms
+			profile['slowest'] = statement
+
+	# Flask signals and hooks. Templates can render others while they render
+	# (e.g. the room_list template global), so start times are kept on a
+	# stack and only the outermost render is added to render_ms.
+	def before_render(self, sender, template, context, **extra):
+		if 'profile' in g:
+			g.profile['render_starts'].append(time.perf_counter())
+
+	def after_render(self, sender, template, context, **extra):
+		if 'profile' in g and g.profile['render_starts']:
+			start = g.profile['render_starts'].pop()
+			if not g.profile['render_starts']:
+				g.profile['render_ms'] += (time.perf_counter() - start) * 1000
+
+	def before_request(self):
+		if not self.enabled:
+			return
+		g.profile = {'start': time.perf_counter(), 'queries': 0, 'sql_ms': 0.0,
+			'slowest_ms': 0.0, 'slowest': None, 'render_ms': 0.0, 'render_starts': []}
+
+	def after_request(self, response):
+		profile = g.pop('profile', None)
+		if profile is None:
+			return response
+		total_ms = (time.perf_counter() - profile['start']) * 1000
+
+		response.headers['Server-Timing'] = ", ".join([
+			'db;dur={:.2f};desc="{} queries"'.format(profile['sql_ms'], profile['queries']),
+			'tpl;dur={:.2f}'.format(profile['render_ms']),
+			'total;dur={:.2f}'.format(total_ms),
+		])
+
+		endpoint = request.endpoint or "<unknown>"
+		with self._lock:
+			if endpoint not in self.endpoints:
+				self.endpoints[endpoint] = EndpointStats(self.window)
+			self.endpoints[endpoint].add(profile, total_ms)
+		return response
+
+	def stats_allowed(self):
+		# Whether the current request may read /_debug/stats
+		config = self.app.config
+		if not (config.get('DEBUG') or config.get('DEBUG_STATS')):
+			return False
+		token = config.get('DEBUG_STATS_TOKEN')
+		if token:
+			sent = request.headers.get('X-Debug-Token', '')
+			return hmac.compare_digest(sent.encode('utf-8'), token.encode('utf-8'))
+		return request.remote_addr in LOOPBACK_ADDRESSES
+
+	def stats_view(self):
+		# Return the rolling per-endpoint statistics in JSON format
+		if not self.enabled or not self.stats_allowed():
+			abort(404)
+		with self._lock:
+			endpoints = dict((name, stats.summary()) for name, stats in self.endpoints.items())
+		result = {'endpoints': endpoints}
+		for name, provider in self.stats_providers.items():
+			result[name] = provider()
+		return jsonify(result)
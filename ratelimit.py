@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Rate limiting and admission control of a Flask app's endpoints.
+#
+# Rate limits are token buckets per endpoint and client (the logged-in user,
+# or the IP address of anonymous clients): a limit of "60/minute" allows
+# bursts of 60 requests and refills one token a second. Requests over the
+# limit are answered 429 with Retry-After. Buckets are kept in process
+# (MemoryBucketStore) or in a local SQLite file shared by all worker
+# processes (SQLBucketStore).
+#
+# Concurrency limits cap the requests of an endpoint running at the same
+# time in a worker; requests over the cap are answered 503 with Retry-After
+# instead of queueing up.
+
+from flask import g, request
+from sqlalchemy import text
+
+from collections import OrderedDict
+from threading import Lock, BoundedSemaphore
+import math
+import time
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+SWEEP_INTERVAL = 3600 # seconds between two sweeps of unused shared buckets
+
+
+def parse_rate(rate):
+	# Return (capacity, tokens per second) of a limit such as "60/minute"
+	count, period = rate.split("/")
+	count = int(count)
+	return count, float(count) / PERIODS[period.strip()]
+
+def parse_limits(text, convert = str):
+	# Parse "JSON=30/minute;addItem=60/minute" into {endpoint: value}
+	limits = {}
+	for entry in (text or "").split(";"):
+		if entry.strip():
+			endpoint, value = entry.split("=")
+			limits[endpoint.strip()] = convert(value.strip())
+	return limits
+
+
+class MemoryBucketStore(object):
+	# Token buckets of one process, the least recently used dropped first
+
+	def __init__(self, max_size = 100000):
+		self.max_size = max_size
+		self._buckets = OrderedDict()
+		self._lock = Lock()
+
+	def take(self, key, capacity, refill_rate):
+		# Take a token from a bucket. Return 0 if it had one, otherwise the
+		# number of seconds until it will.
+		now = time.time()
+		with self._lock:
+			tokens, updated = self._buckets.pop(key, (capacity, now))
+			tokens = min(capacity, tokens + (now - updated) * refill_rate)
+			wait = 0 if tokens >= 1 else (1 - tokens) / refill_rate
+			if not wait:
+				tokens -= 1
+			self._buckets[key] = (tokens, now)
+			while len(self._buckets) > self.max_size:
+				self._buckets.popitem(last = False)
+		return wait
+
+
+class SQLBucketStore(object):
+	# Token buckets in a SQLite database shared by the worker processes.
+	# Every take is a single UPSERT, so concurrent workers never race.
+	# Buckets unused for a day are swept every SWEEP_INTERVAL seconds.
+
+	TAKE = text("""
+		INSERT INTO rate_bucket(key, tokens, updated, allowed)
+		VALUES (:key, :capacity - 1, :now, 1)
+		ON CONFLICT(key) DO UPDATE SET
+			allowed = MIN(:capacity, tokens + (:now - updated) * :rate) >= 1,
+			tokens = MIN(:capacity, tokens + (:now - updated) * :rate) -
+				(MIN(:capacity, tokens + (:now - updated) * :rate) >= 1),
+			updated = :now
+		RETURNING tokens, allowed""")
+
+	def __init__(self, engine):
+		self.engine = engine
+		self._swept = time.time()
+		with engine.begin() as connection:
+			connection.execute(text("""CREATE TABLE IF NOT EXISTS rate_bucket(
+				key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL,
+				allowed INTEGER NOT NULL)"""))
+
+	def take(self, key, capacity, refill_rate):
+		now = time.time()
+		if now - self._swept >= SWEEP_INTERVAL:
+			self._swept = now
+			self.sweep()
+		with self.engine.begin() as connection:
+			tokens, allowed = connection.execute(self.TAKE, {'key': key, 'capacity': capacity,
+				'rate': refill_rate, 'now': now}).one()
+		return 0 if allowed else (1 - tokens) / refill_rate
+
+	def sweep(self, max_age = 86400):
+		# Remove buckets unused for max_age seconds (they are full again)
+		with self.engine.begin() as connection:
+			return connection.execute(text("DELETE FROM rate_bucket WHERE updated < :cutoff"),
+				{'cutoff': time.time() - max_age}).rowcount
+
+
+class EndpointCounters(object):
+	# Allowed, rejected and running requests of one endpoint
+	def __init__(self):
+		self.allowed = 0
+		self.rate_limited = 0
+		self.over_capacity = 0
+		self.in_progress = 0
+
+
+class Limiter(object):
+	# Applies the rate limits (RATE_LIMITS) and concurrency limits
+	# (CONCURRENCY_LIMITS) of app.config to the endpoints of an app.
+	# key_func returns the client of the current request, and error_response
+	# builds the response of a rejected request from (message, status).
+	# Endpoints in exempt are never limited.
+
+	def __init__(self, store, key_func, error_response, exempt = ('static',), app = None):
+		self.store = store
+		self.key_func = key_func
+		self.error_response = error_response
+		self.exempt = set(exempt)
+		self.rate_limits = {}
+		self.concurrency_limits = {}
+		self.counters = {}
+		self._lock = Lock()
+		if app is not None:
+			self.init_app(app)
+
+	def init_app(self, app):
+		# Load the limits of app.config. It may be called again with new
+		# settings: the hooks are only registered once per app.
+		self.rate_limits = dict((endpoint, parse_rate(rate)) for endpoint, rate in
+			parse_limits(app.config.get('RATE_LIMITS')).items())
+		self.concurrency_limits = dict((endpoint, (limit, BoundedSemaphore(limit))) for endpoint, limit in
+			parse_limits(app.config.get('CONCURRENCY_LIMITS'), int).items())
+
+		if 'limiter' in app.extensions:
+			return
+		app.extensions['limiter'] = self
+		app.before_request(self.before_request)
+		app.teardown_request(self.teardown_request)
+
+	def count(self, endpoint, field, increment = 1):
+		with self._lock:
+			counters = self.counters.setdefault(endpoint, EndpointCounters())
+			setattr(counters, field, getattr(counters, field) + increment)
+
+	def reject(self, message, status, retry_after):
+		response = self.error_response(message, status)
+		response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+		return response
+
+	def before_request(self):
+		endpoint = request.endpoint
+		limit = self.rate_limits.get(endpoint, self.rate_limits.get('*'))
+		if endpoint is None or endpoint in self.exempt or \
+			(limit is None and endpoint not in self.concurrency_limits):
+			return None
+
+		if limit is not None:
+			capacity, refill_rate = limit
+			wait = self.store.take("{}:{}".format(endpoint, self.key_func()), capacity, refill_rate)
+			if wait:
+				self.count(endpoint, 'rate_limited')
+				return self.reject("Too many requests, please retry later", 429, wait)
+
+		if endpoint in self.concurrency_limits:
+			semaphore = self.concurrency_limits[endpoint][1]
+			if not semaphore.acquire(blocking = False):
+				self.count(endpoint, 'over_capacity')
+				return self.reject("Server busy, please retry later", 503, 1)
+			g.concurrency_slot = (endpoint, semaphore)
+			self.count(endpoint, 'in_progress')
+
+		self.count(endpoint, 'allowed')
+		return None
+
+	def teardown_request(self, exception = None):
+		# Runs once the response is sent, after the end of a streamed body.
+		# The slot goes back to the semaphore it was taken from, even if the
+		# limits were reloaded in between.
+		slot = g.pop('concurrency_slot', None)
+		if slot is not None:
+			endpoint, semaphore = slot
+			self.count(endpoint, 'in_progress', -1)
+			semaphore.release()
+
+	def stats(self):
+		# Return the counters of every endpoint that received requests
+		with self._lock:
+			endpoints = dict((endpoint, dict(vars(counters))) for endpoint, counters in self.counters.items())
+		for endpoint, (limit, semaphore) in self.concurrency_limits.items():
+			if endpoint in endpoints:
+				endpoints[endpoint]['max_concurrency'] = limit
+		return endpoints
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Server-side sessions for Flask.
+#
+# The session cookie only holds an opaque random id; the session dictionary
+# itself is kept in a store (the web_session table or an in-process LRU
+# cache). Sessions expire after app.permanent_session_lifetime of
+# inactivity and expired ones are swept from the store periodically.
+
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+from sqlalchemy import select
+
+from database_setup import WebSession, sweep_sessions
+from cache import LRUCache
+
+from datetime import datetime
+import secrets
+import time
+
+SWEEP_INTERVAL = 600 # seconds between two sweeps of expired sessions
+
+
+class ServerSession(CallbackDict, SessionMixin):
+	# Session dictionary identified by sid; any change marks it modified
+
+	def __init__(self, initial = None, sid = None, expires = None):
+		def on_update(session):
+			session.modified = True
+		CallbackDict.__init__(self, initial, on_update)
+		self.sid = sid
+		self.expires = expires
+		self.new = sid is None
+		self.modified = False
+		self.old_sid = None
+
+	def regenerate(self):
+		# Move the session to a new id, e.g. after login, so an id known
+		# before the login cannot be used to take over the session
+		if self.sid is not None:
+			self.old_sid = self.sid
+		self.sid = None
+		self.modified = True
+
+
+class SessionStore(object):
+	# Common interface of all session stores. Data is the serialized
+	# session dictionary and expires a naive UTC datetime.
+
+	def load(self, sid):
+		# Return (data, expires) of a live session, or None
+		raise NotImplementedError
+
+	def save(self, sid, data, expires):
+		raise NotImplementedError
+
+	def delete(self, sid):
+		raise NotImplementedError
+
+	def sweep(self):
+		# Remove expired sessions and return how many were removed
+		return 0
+
+
+class MemoryStore(SessionStore):
+	# Sessions in an in-process LRU cache. Expired entries are dropped by
+	# the cache's time-to-live, so there is nothing to sweep. Every worker
+	# process has its own sessions, so use it with a single process only.
+
+	def __init__(self, max_size = 10000):
+		self.cache = LRUCache(max_size)
+
+	def load(self, sid):
+		return self.cache.get(sid)
+
+	def save(self, sid, data, expires):
+		ttl = (expires - datetime.utcnow()).total_seconds()
+		self.cache.set(sid, (data, expires), ttl)
+
+	def delete(self, sid):
+		self.cache.delete(sid)
+
+
+class SQLStore(SessionStore):
+	# Sessions in the web_session table, shared by all worker processes
+
+	def __init__(self, engine):
+		self.engine = engine
+		self.table = WebSession.__table__
+
+	def load(self, sid):
+		with self.engine.connect() as connection:
+			row = connection.execute(select(self.table.c.data, self.table.c.expires).where(
+				self.table.c.id == sid, self.table.c.expires > datetime.utcnow())).first()
+		return tuple(row) if row is not None else None
+
+	def save(self, sid, data, expires):
+		with self.engine.begin() as connection:
+			updated = connection.execute(self.table.update().where(self.table.c.id == sid).values(
+				data = data, expires = expires)).rowcount
+			if not updated:
+				connection.execute(self.table.insert().values(id = sid, data = data, expires = expires))
+
+	def delete(self, sid):
+		with self.engine.begin() as connection:
+			connection.execute(self.table.delete().where(self.table.c.id == sid))
+
+	def sweep(self):
+		return sweep_sessions(self.engine)
+
+
+class ServerSessionInterface(SessionInterface):
+	# Keeps sessions in store and only the session id in the cookie.
+	# A session is written when it changes, or when less than half of its
+	# lifetime is left, so reading it does not cost a write per request.
+
+	serializer = TaggedJSONSerializer()
+
+	def __init__(self, store, sweep_interval = SWEEP_INTERVAL):
+		self.store = store
+		self.sweep_interval = sweep_interval
+		self._swept = time.time()
+
+	def open_session(self, app, request):
+		sid = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+		if sid:
+			stored = self.store.load(sid)
+			if stored is not None:
+				data, expires = stored
+				return ServerSession(self.serializer.loads(data), sid, expires)
+		return ServerSession()
+
+	def save_session(self, app, session, response):
+		name = app.config['SESSION_COOKIE_NAME']
+		domain = self.get_cookie_domain(app)
+		path = self.get_cookie_path(app)
+
+		if session.old_sid is not None:
+			self.store.delete(session.old_sid)
+
+		if not session:
+			# Drop an emptied session, e.g. after logout
+			if not session.new:
+				if session.sid is not None:
+					self.store.delete(session.sid)
+				response.delete_cookie(name, domain = domain, path = path)
+			return
+
+		lifetime = app.permanent_session_lifetime
+		now = datetime.utcnow()
+		refresh = session.expires is None or session.expires - now < lifetime / 2
+		if not (session.modified or refresh):
+			return
+
+		if session.sid is None:
+			session.sid = secrets.token_urlsafe(32)
+		session.expires = now + lifetime
+		self.store.save(session.sid, self.serializer.dumps(dict(session)), session.expires)
+		response.set_cookie(name, session.sid, expires = self.get_expiration_time(app, session),
+			httponly = self.get_cookie_httponly(app), domain = domain, path = path,
+			secure = self.get_cookie_secure(app), samesite = self.get_cookie_samesite(app))
+		self.sweep()
+
+	def sweep(self):
+		# Remove expired sessions at most every sweep_interval seconds
+		if time.time() - self._swept >= self.sweep_interval:
+			self._swept = time.time()
+			self.store.sweep()
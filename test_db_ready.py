@@ -3,11 +3,11 @@
 ''' Import all dependencies and set up the database session
 for quick access to the database from IDLE '''
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from database_setup import Base, User, Room, Item
+from db import create_db_engine
 
-engine = create_engine('sqlite:///room_item_user.db')
+engine = create_db_engine()
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind = engine)
 session = DBSession()
\ No newline at end of file
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Shared fixtures of the test suite: a fresh SQLite database per test, the
+# app of main.py configured for it by create_app(), and a test client
+# logged in as the owner of the generated data.
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+from sqlalchemy import event
+
+from database_setup import setup_db
+from db import create_db_engine
+import generate_data
+import main
+
+OWNER_ID = 1 # id of the first generated user
+
+
+def make_database(path, users = 1, rooms = 3, items = 5):
+	# Create a database at path filled with generated data; return its URL
+	url = "sqlite:///" + str(path)
+	engine = create_db_engine(url)
+	setup_db(engine)
+	generate_data.generate(engine, users, rooms, items)
+	engine.dispose()
+	return url
+
+def configure(url, **settings):
+	# Point the app at a database with the test settings and empty caches
+	config = {
+		'TESTING'            : True,
+		'DATABASE_URL'       : url,
+		'SESSION_BACKEND'    : 'memory',
+		'RATE_LIMITS'        : "",
+		'CONCURRENCY_LIMITS' : "",
+		'RATE_LIMIT_STORE'   : 'memory',
+		'WARM_UP'            : False,
+		'CLIENT_SECRETS_FILE': os.path.join(ROOT, 'client_secrets.json'),
+	}
+	config.update(settings)
+	main.rooms_cache.clear()
+	main.fragment_cache.clear()
+	return main.create_app(config)
+
+def login(client, user_id = OWNER_ID):
+	# Log a test client in as the generated user with the given id
+	with client.session_transaction() as login_session:
+		login_session['username'] = "User {}".format(user_id - 1)
+		login_session['email'] = "user0-{}@example.com".format(user_id - 1)
+		login_session['user_id'] = user_id
+
+
+@pytest.fixture
+def database(tmp_path):
+	return make_database(tmp_path / "app.db")
+
+@pytest.fixture
+def app(database):
+	app = configure(database)
+	yield app
+	main.session.remove()
+
+@pytest.fixture
+def client(app):
+	client = app.test_client()
+	login(client)
+	return client
+
+
+class QueryCounter(object):
+	# Record the SQL statements executed on an engine while in a with block
+	def __init__(self, engine):
+		self.engine = engine
+		self.statements = []
+
+	def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+		self.statements.append((statement, parameters))
+
+	def __enter__(self):
+		event.listen(self.engine, "before_cursor_execute", self.on_execute)
+		return self
+
+	def __exit__(self, *exc_info):
+		event.remove(self.engine, "before_cursor_execute", self.on_execute)
+
+	@property
+	def count(self):
+		return len(self.statements)
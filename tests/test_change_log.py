@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# The change log behind /api/changes: cursors handed out by the server must
+# keep working after retention removed the changes they point to.
+
+import sqlite3
+
+from sqlalchemy import text
+
+from conftest import configure, login, make_database
+from database_setup import compact_change_log, upgrade_change_log
+from db import create_db_engine
+import main
+
+
+def expire_changes(url):
+	# Make every change older than the retention period and apply it
+	engine = create_db_engine(url)
+	with engine.begin() as connection:
+		connection.execute(text("UPDATE change_log SET created_at = '2000-01-01 00:00:00'"))
+	compact_change_log(engine)
+	engine.dispose()
+
+
+def test_ids_are_not_reused_after_a_full_purge(client, database):
+	cursor = client.get("/api/changes").get_json()['cursor']
+	assert cursor > 0
+
+	expire_changes(database)
+	client.post("/room/add/", data = {'name': "After purge"})
+
+	response = client.get("/api/changes?since={}".format(cursor))
+	assert response.status_code == 200
+	changes = response.get_json()['changes']
+	assert len(changes) == 1
+	assert changes[0]['id'] > cursor
+	assert changes[0]['data']['name'] == "After purge"
+
+def test_upgrade_keeps_ids_increasing(tmp_path):
+	# A change log created without AUTOINCREMENT is recreated with it, and
+	# continues after the purged ids
+	path = str(tmp_path / "old.db")
+	connection = sqlite3.connect(path)
+	connection.executescript("""
+		CREATE TABLE change_log (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL,
+			entity VARCHAR(4) NOT NULL, entity_id INTEGER NOT NULL, room_id INTEGER,
+			action VARCHAR(6) NOT NULL, created_at DATETIME NOT NULL);
+		CREATE TABLE change_log_state (id INTEGER NOT NULL PRIMARY KEY, purged_up_to INTEGER NOT NULL);
+		INSERT INTO change_log_state VALUES (1, 19);""")
+	connection.close()
+
+	engine = create_db_engine("sqlite:///" + path)
+	assert upgrade_change_log(engine)
+	assert not upgrade_change_log(engine)
+	with engine.begin() as connection:
+		connection.execute(text(
+			"INSERT INTO change_log(user_id, entity, entity_id, action, created_at) "
+			"VALUES (1, 'room', 1, 'insert', CURRENT_TIMESTAMP)"))
+		assert connection.execute(text("SELECT MAX(id) FROM change_log")).scalar() == 20
+	engine.dispose()
+
+def test_new_client_cursor_after_purge(tmp_path):
+	# The owner's changes are purged, another user keeps writing: a client
+	# starting now gets a cursor it can poll with
+	database = make_database(tmp_path / "app.db", users = 2)
+	expire_changes(database)
+	engine = create_db_engine(database)
+	with engine.begin() as connection:
+		connection.execute(text("INSERT INTO room(name, user_id) VALUES ('Not mine', 2)"))
+	engine.dispose()
+
+	client = configure(database).test_client()
+	login(client)
+	cursor = client.get("/api/changes").get_json()['cursor']
+	assert cursor > 0
+	response = client.get("/api/changes?since={}".format(cursor))
+	assert response.status_code == 200
+	assert response.get_json()['changes'] == []
+
+	client.post("/room/add/", data = {'name': "Mine"})
+	changes = client.get("/api/changes?since={}".format(cursor)).get_json()['changes']
+	assert [change['data']['name'] for change in changes] == ["Mine"]
+	main.session.remove()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Many threads adding and editing items at once through the routes: every
+# write must land, with one revision bump each and consistent room_stats.
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from conftest import OWNER_ID, login
+from database_setup import verify_room_stats
+import main
+
+THREADS = 8
+WRITES_PER_THREAD = 10
+
+
+def test_parallel_add_and_edit(app):
+	with main.engine.connect() as connection:
+		room_ids = [row.id for row in connection.execute(text(
+			"SELECT id FROM room WHERE user_id = :id ORDER BY id"), {'id': OWNER_ID})]
+		item_ids = [row.id for row in connection.execute(text(
+			"SELECT id FROM item WHERE room_id = :id ORDER BY id"), {'id': room_ids[0]})]
+		items_before = connection.execute(text("SELECT COUNT(*) FROM item")).scalar()
+
+	def work(worker):
+		# Alternately add an item to a room and rename an item of the first room
+		client = app.test_client()
+		login(client)
+		statuses = []
+		for i in range(WRITES_PER_THREAD):
+			if i % 2 == 0:
+				room_id = room_ids[(worker + i) % len(room_ids)]
+				response = client.post("/room/{}/items/add/".format(room_id), data = {
+					'name': "Added {}-{}".format(worker, i), 'description': "", 'price': "$ 2"})
+			else:
+				item_id = item_ids[(worker + i) % len(item_ids)]
+				response = client.post("/room/{}/items/{}/edit/".format(room_ids[0], item_id), data = {
+					'name': "Edited {}-{}".format(worker, i), 'description': "", 'price': "$ 3"})
+			statuses.append(response.status_code)
+		return statuses
+
+	with ThreadPoolExecutor(max_workers = THREADS) as executor:
+		statuses = [status for result in executor.map(work, range(THREADS)) for status in result]
+
+	assert statuses == [302] * (THREADS * WRITES_PER_THREAD)
+
+	adds = THREADS * ((WRITES_PER_THREAD + 1) // 2)
+	with main.engine.connect() as connection:
+		assert connection.execute(text("SELECT COUNT(*) FROM item")).scalar() == items_before + adds
+		assert connection.execute(text(
+			"SELECT COUNT(*) FROM item WHERE name LIKE 'Added %'")).scalar() == adds
+		assert connection.execute(text("SELECT revision FROM user WHERE id = :id"),
+			{'id': OWNER_ID}).scalar() == THREADS * WRITES_PER_THREAD
+	assert verify_room_stats(main.engine) == []
+
+	# Every page reflects the writes afterwards
+	client = app.test_client()
+	login(client)
+	document = client.get("/JSON").get_json()
+	assert sum(len(room['items']) for room in document['Rooms']) == items_before + adds
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+# create_app() can be called again, also after requests were served: the
+# new settings apply and no hook runs twice.
+
+from flask.sessions import SecureCookieSessionInterface
+
+from conftest import configure, login
+
+
+def test_create_app_twice_registers_hooks_once(database):
+	configure(database, RATE_LIMITS = "apiRooms=4/minute")
+	app = configure(database, RATE_LIMITS = "apiRooms=4/minute")
+	client = app.test_client()
+	login(client)
+	assert [client.get("/api/rooms").status_code for i in range(5)] == [200, 200, 200, 200, 429]
+
+def test_create_app_after_first_request(database):
+	app = configure(database)
+	client = app.test_client()
+	login(client)
+	assert client.get("/api/rooms").status_code == 200
+
+	# A new memory session store is created, so log in again
+	app = configure(database, RATE_LIMITS = "apiRooms=1/minute")
+	login(client)
+	assert [client.get("/api/rooms").status_code for i in range(2)] == [200, 429]
+
+def test_create_app_switches_back_to_cookie_sessions(database):
+	configure(database, SESSION_BACKEND = "memory")
+	app = configure(database, SESSION_BACKEND = "cookie")
+	assert type(app.session_interface) is SecureCookieSessionInterface
+	client = app.test_client()
+	login(client)
+	assert client.get("/api/rooms").status_code == 200
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# /api/import with malformed JSON documents: whole-document problems are
+# answered 400, bad rooms and items are reported per row. Files that cannot
+# be read to the end report what was committed before the error. Imports
+# from the command line invalidate the ETags and caches of the user's pages.
+
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.mark.parametrize("document", ['[]', '{"Rooms": 5}', '{"Rooms": null}', '"text"'])
+def test_import_rejects_malformed_documents(client, document):
+	revision = client.get("/JSON").headers['ETag']
+	response = client.post("/api/import?format=json", data = document)
+	assert response.status_code == 400
+	# A failed import commits nothing, not even a revision bump
+	assert client.get("/JSON").headers['ETag'] == revision
+
+def test_import_reports_bad_entries_per_row(client):
+	document = '''{"Rooms": [null, {"name": "Hall", "items": [1, {"name": "Coat"}]},
+		{"name": "Shed", "items": 3}]}'''
+	response = client.post("/api/import?format=json", data = document)
+	assert response.status_code == 200
+	assert response.get_json() == {'rooms_created': 2, 'items_imported': 1, 'errors': [
+		{'row': 1, 'error': "Expected a room object"},
+		{'row': 3, 'error': "Expected an item object"},
+		{'row': 6, 'error': "items must be a list"},
+	]}
+
+def test_import_rejects_unreadable_csv(client):
+	# The csv module refuses fields over its size limit (131072 bytes)
+	document = 'room,name,description,price\nHall,Coat,"{}",\n'.format("x" * 200000)
+	response = client.post("/api/import?format=csv", data = document)
+	assert response.status_code == 400
+	assert "Could not read the csv file" in response.get_json()
+
+def test_import_reports_batches_committed_before_a_read_error(client):
+	lines = ['{"type": "room", "name": "Attic"}'] + \
+		['{{"room": "Attic", "name": "Box {}"}}'.format(i) for i in range(2000)]
+	data = ("\n".join(lines) + "\n").encode() + b'{"room": "Attic", "name": "\xff"}\n'
+	response = client.post("/api/import?format=ndjson&batch_size=1",
+		data = {'file': (io.BytesIO(data), "items.ndjson")})
+	assert response.status_code == 207
+	report = response.get_json()
+	assert report['rooms_created'] == 1
+	assert "Could not read the ndjson file" in report['error']
+
+	rooms = client.get("/JSON").get_json()['Rooms']
+	attic = [room for room in rooms if room['name'] == "Attic"][0]
+	assert len(attic['items']) == report['items_imported'] > 0
+
+def test_command_line_import_bumps_the_revision(client, database, tmp_path):
+	response = client.get("/JSON")
+	etag, items = response.headers['ETag'], sum(len(room['items']) for room in response.get_json()['Rooms'])
+	client.get("/rooms/") # fills the room list caches
+
+	csv_file = tmp_path / "items.csv"
+	csv_file.write_text("room,name,description,price\nHall,Coat,,$ 20\n")
+	subprocess.check_call([sys.executable, os.path.join(ROOT, "importer.py"),
+		"user0-0@example.com", str(csv_file)], cwd = ROOT,
+		env = dict(os.environ, DATABASE_URL = database), stdout = subprocess.DEVNULL)
+
+	response = client.get("/JSON", headers = {'If-None-Match': etag})
+	assert response.status_code == 200
+	assert response.headers['ETag'] != etag
+	assert sum(len(room['items']) for room in response.get_json()['Rooms']) == items + 1
+	assert b"Hall" in client.get("/rooms/").data
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# oauth_http.py and the gconnect/logout routes against a local stub of
+# Google's OAuth endpoints, served by http.server on a background thread.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import base64
+import json
+import threading
+
+import pytest
+from oauth2client.client import FlowExchangeError, OAuth2WebServerFlow
+
+from conftest import configure
+import main
+import oauth_http
+
+CLIENT_ID = "test-client.apps.googleusercontent.com"
+GPLUS_ID = "1234567890"
+
+
+def id_token(payload):
+	# Return an unsigned JWT carrying payload, as oauth2client only decodes it
+	def encode(data):
+		return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).rstrip(b"=").decode("ascii")
+	return "{}.{}.signature".format(encode({'alg': "none"}), encode(payload))
+
+
+class StubOAuthHandler(BaseHTTPRequestHandler):
+	# Answers the token, tokeninfo, userinfo and revoke endpoints
+	protocol_version = "HTTP/1.1" # keep-alive, so connection reuse is visible
+
+	def log_message(self, format, *args):
+		pass
+
+	def reply(self, status, data):
+		body = json.dumps(data).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_POST(self):
+		form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+		self.server.calls.append(("token", self.client_address, form['code'][0]))
+		if form['code'][0] != "good-code":
+			return self.reply(400, {'error': "invalid_grant"})
+		self.reply(200, {'access_token': "access-1", 'token_type': "Bearer", 'expires_in': 3600,
+			'id_token': id_token({'sub': GPLUS_ID, 'email': "stub@example.com"})})
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+		self.server.calls.append((url.path.strip("/"), self.client_address, query))
+		if url.path in ("/tokeninfo", "/userinfo") and self.server.barrier is not None:
+			# Both calls must be in flight at the same time to pass
+			try:
+				self.server.barrier.wait(timeout = 5)
+			except threading.BrokenBarrierError:
+				return self.reply(200, {'error': "calls were not concurrent"})
+
+		if url.path == "/tokeninfo":
+			self.reply(200, {'user_id': GPLUS_ID, 'issued_to': CLIENT_ID, 'expires_in': 3600})
+		elif url.path == "/userinfo":
+			self.reply(200, {'name': "Stub User", 'email': "stub@example.com",
+				'picture': "http://example.com/stub.png"})
+		elif url.path == "/revoke":
+			self.reply(200 if query.get('token') == "access-1" else 400, {})
+		else:
+			self.reply(404, {})
+
+
+@pytest.fixture
+def stub(monkeypatch):
+	server = ThreadingHTTPServer(("127.0.0.1", 0), StubOAuthHandler)
+	server.calls = []
+	server.barrier = None
+	server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+	thread = threading.Thread(target = server.serve_forever, args = (0.05,), daemon = True)
+	thread.start()
+
+	monkeypatch.setattr(oauth_http, "TOKENINFO_URL", server.url + "/tokeninfo")
+	monkeypatch.setattr(oauth_http, "USERINFO_URL", server.url + "/userinfo")
+	monkeypatch.setattr(oauth_http, "REVOKE_URL", server.url + "/revoke")
+	yield server
+	server.shutdown()
+	server.server_close()
+
+def stub_flow(stub):
+	return OAuth2WebServerFlow(client_id = CLIENT_ID, client_secret = "secret", scope = "",
+		redirect_uri = "postmessage", auth_uri = stub.url + "/auth", token_uri = stub.url + "/token")
+
+
+def test_exchange_code_runs_on_the_calling_thread(stub, monkeypatch):
+	# Without a worker pool the exchange must still work
+	monkeypatch.setattr(oauth_http, "executor", None)
+	credentials = oauth_http.exchange_code(stub_flow(stub), "good-code")
+	assert credentials.access_token == "access-1"
+	assert credentials.id_token['sub'] == GPLUS_ID
+	assert [call[0] for call in stub.calls] == ["token"]
+
+def test_exchange_code_rejected(stub):
+	with pytest.raises(FlowExchangeError):
+		oauth_http.exchange_code(stub_flow(stub), "bad-code")
+
+def test_fetch_token_details_runs_both_calls_concurrently(stub):
+	stub.barrier = threading.Barrier(2)
+	tokeninfo, userinfo = oauth_http.fetch_token_details("access-1")
+	assert tokeninfo == {'user_id': GPLUS_ID, 'issued_to': CLIENT_ID, 'expires_in': 3600}
+	assert userinfo['email'] == "stub@example.com"
+	assert sorted(call[0] for call in stub.calls) == ["tokeninfo", "userinfo"]
+
+def test_calls_reuse_pooled_connections(stub):
+	for i in range(3):
+		oauth_http.get_tokeninfo("access-1")
+	client_addresses = set(call[1] for call in stub.calls)
+	assert len(stub.calls) == 3 and len(client_addresses) == 1
+
+def test_revoke_token(stub, monkeypatch):
+	monkeypatch.setattr(oauth_http, "executor", None)
+	assert oauth_http.revoke_token("access-1") is True
+	assert oauth_http.revoke_token("unknown") is False
+	assert [call[2]['token'] for call in stub.calls] == ["access-1", "unknown"]
+
+def test_gconnect_and_logout(stub, database, tmp_path):
+	secrets_file = tmp_path / "client_secrets.json"
+	secrets_file.write_text(json.dumps({'web': {'client_id': CLIENT_ID, 'client_secret': "secret",
+		'auth_uri': stub.url + "/auth", 'token_uri': stub.url + "/token"}}))
+	app = configure(database, CLIENT_SECRETS_FILE = str(secrets_file))
+	client = app.test_client()
+
+	assert client.get("/login").status_code == 200
+	with client.session_transaction() as login_session:
+		state = login_session['state']
+
+	response = client.post("/gconnect?state={}".format(state), data = b"good-code")
+	assert response.status_code == 200
+	assert b"Welcome, Stub User" in response.data
+	with client.session_transaction() as login_session:
+		assert login_session['email'] == "stub@example.com"
+	with main.engine.connect() as connection:
+		assert connection.exec_driver_sql(
+			"SELECT name FROM user WHERE email = 'stub@example.com'").scalar() == "Stub User"
+
+	response = client.get("/logout")
+	assert response.status_code == 200
+	endpoints = [call[0] for call in stub.calls]
+	assert endpoints[0] == "token" and endpoints[-1] == "revoke"
+	assert sorted(endpoints[1:-1]) == ["tokeninfo", "userinfo"]
+	with client.session_transaction() as login_session:
+		assert 'email' not in login_session
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Request profiling: /_debug/stats access control and the template render
+# time of pages rendering nested templates.
+
+import re
+import time
+
+import pytest
+
+from conftest import configure, login
+import main
+
+
+def client_for(database, **settings):
+	client = configure(database, PROFILING = True, **settings).test_client()
+	login(client)
+	return client
+
+@pytest.mark.parametrize("settings, headers, remote_addr, status", [
+	({}, {}, "127.0.0.1", 404),
+	({'DEBUG_STATS': True}, {}, "127.0.0.1", 200),
+	({'DEBUG_STATS': True}, {}, "10.0.0.1", 404),
+	({'DEBUG_STATS': True, 'DEBUG_STATS_TOKEN': "s3cret"}, {}, "127.0.0.1", 404),
+	({'DEBUG_STATS': True, 'DEBUG_STATS_TOKEN': "s3cret"}, {'X-Debug-Token': "wrong"}, "10.0.0.1", 404),
+	({'DEBUG_STATS': True, 'DEBUG_STATS_TOKEN': "s3cret"}, {'X-Debug-Token': "s3cret"}, "10.0.0.1", 200),
+])
+def test_debug_stats_access(database, settings, headers, remote_addr, status):
+	client = client_for(database, **settings)
+	response = client.get("/_debug/stats", headers = headers, environ_base = {'REMOTE_ADDR': remote_addr})
+	assert response.status_code == status
+
+def test_nested_render_keeps_the_page_render_time(database, monkeypatch):
+	client = client_for(database)
+	render_fragment = main.render_fragment
+
+	def slow_render_fragment(key, template, get_context):
+		# 20 ms spent in the page template before it renders the room list
+		time.sleep(0.02)
+		return render_fragment(key, template, get_context)
+	monkeypatch.setattr(main, "render_fragment", slow_render_fragment)
+
+	timing = client.get("/room/1/items/1/").headers['Server-Timing']
+	render_ms = float(re.search(r"tpl;dur=([\d.]+)", timing).group(1))
+	assert render_ms >= 20
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# The /JSON export runs a fixed number of queries, whatever the number of
+# rooms and items (no query per room, no lazy loads per item).
+
+import json
+
+import pytest
+
+from conftest import QueryCounter, configure, login, make_database
+import main
+
+
+def export(client):
+	# Return (number of queries, parsed document) of a /JSON request
+	with QueryCounter(main.engine) as counter:
+		response = client.get("/JSON")
+	assert response.status_code == 200
+	return counter.count, json.loads(response.data)
+
+@pytest.mark.parametrize("rooms, items", [(1, 1), (5, 10), (40, 25)])
+def test_json_export_query_count(tmp_path, rooms, items):
+	app = configure(make_database(tmp_path / "export.db", rooms = rooms, items = items))
+	client = app.test_client()
+	login(client)
+
+	count, document = export(client)
+
+	# The user's revision (for the ETag), the rooms and the items
+	assert count == 3
+	assert len(document['Rooms']) == rooms
+	assert all(len(room['items']) == items for room in document['Rooms'])
+
+def test_json_export_shape(client):
+	count, document = export(client)
+	room = document['Rooms'][0]
+	assert set(room) == {'id', 'name', 'owner', 'items'}
+	assert set(room['items'][0]) == {'id', 'name', 'owner', 'room', 'description', 'price'}
+	assert room['items'][0]['room'] == room['name']
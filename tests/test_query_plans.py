@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# EXPLAIN QUERY PLAN of every statement the item listing, price, export
+# and search routes run: each one searches an index, none scans a table.
+
+import re
+
+import pytest
+
+from conftest import QueryCounter
+import main
+
+TABLE_SCAN = re.compile(r"\bSCAN (?:TABLE )?(item|room|user|room_stats)\b")
+
+# (route, index used by its item query)
+ROUTES = [
+	("/room/1/items/", "ix_item_room_id_id"),
+	("/room/1/items/?sort=name", "ix_item_room_id_name"),
+	("/room/1/items/?sort=price&order=desc&after=100&after_id=3", "ix_item_room_id_price_cents"),
+	("/room/1/items/?name=lamp", "ix_item_room_id_id"),
+	("/room/1/items/1/", None),
+	("/api/rooms/1/items?after=2", "ix_item_room_id_id"),
+	("/api/items?min_price=10&max_price=50", "ix_item_user_id_price_cents"),
+	("/api/export", "ix_item_room_id_id"),
+	("/JSON", "ix_item_room_id_id"),
+	("/search/?q=lamp", "item_fts VIRTUAL TABLE"),
+	("/api/search?q=lamp+walnut", "item_fts VIRTUAL TABLE"),
+	("/rooms/", None),
+]
+
+
+def query_plans(statements):
+	# Return the EXPLAIN QUERY PLAN lines of every SELECT
+	plans = []
+	with main.engine.connect() as connection:
+		for statement, parameters in statements:
+			if statement.lstrip().upper().startswith("SELECT"):
+				plans.append((statement, [row[3] for row in connection.exec_driver_sql(
+					"EXPLAIN QUERY PLAN " + statement, parameters)]))
+	return plans
+
+@pytest.mark.parametrize("route, index", ROUTES)
+def test_route_queries_use_indexes(client, route, index):
+	with QueryCounter(main.engine) as counter:
+		response = client.get(route)
+	assert response.status_code == 200
+
+	plans = query_plans(counter.statements)
+	assert plans
+	for statement, plan in plans:
+		scans = [line for line in plan if TABLE_SCAN.search(line)]
+		assert not scans, "{}\n{}".format(statement, plan)
+
+	if index is not None:
+		assert any(index in line for statement, plan in plans for line in plan)
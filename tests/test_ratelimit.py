@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+# Rate limits of logged-out clients are kept per IP address: behind a
+# trusted proxy (TRUSTED_PROXY_HOPS) the address comes from X-Forwarded-For.
+
+import pytest
+
+from conftest import configure
+
+
+def login_statuses(app, addresses):
+	# Request /login/ once from every forwarded address; return the statuses
+	client = app.test_client()
+	return [client.get("/login/", headers = {'X-Forwarded-For': address}).status_code
+		for address in addresses]
+
+@pytest.mark.parametrize("hops, statuses", [(0, [200, 429, 429]), (1, [200, 200, 429])])
+def test_anonymous_clients_behind_a_proxy(database, hops, statuses):
+	app = configure(database, RATE_LIMITS = "login=1/minute", TRUSTED_PROXY_HOPS = hops)
+	assert login_statuses(app, ["203.0.113.1", "203.0.113.2", "203.0.113.2"]) == statuses
+
+def test_proxy_fix_is_not_applied_twice(database):
+	configure(database, TRUSTED_PROXY_HOPS = 1)
+	app = configure(database, RATE_LIMITS = "login=1/minute", TRUSTED_PROXY_HOPS = 0)
+	assert login_statuses(app, ["203.0.113.1", "203.0.113.2"]) == [200, 429]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Read-replica routing (DATABASE_REPLICA_URL) with a second SQLite file as
+# the replica: GET requests read from it, while writes and the @primary_db
+# routes use the primary database.
+
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from conftest import configure, login, make_database
+import main
+
+
+def room_names(url):
+	# Return {id: name} of the rooms in a SQLite database, read directly
+	connection = sqlite3.connect(url[len("sqlite:///"):])
+	try:
+		return dict(connection.execute("SELECT id, name FROM room").fetchall())
+	finally:
+		connection.close()
+
+@pytest.fixture
+def databases(tmp_path):
+	# Return (primary URL, replica URL); the replica is a copy of the primary
+	# whose first room was renamed, to tell which database answered
+	primary = make_database(tmp_path / "primary.db")
+	replica = "sqlite:///" + str(tmp_path / "replica.db")
+	source = sqlite3.connect(primary[len("sqlite:///"):])
+	target = sqlite3.connect(replica[len("sqlite:///"):])
+	source.backup(target)
+	target.execute("UPDATE room SET name = 'From replica' WHERE id = 1")
+	target.commit()
+	source.close()
+	target.close()
+	return primary, replica
+
+@pytest.fixture
+def client(databases):
+	primary, replica = databases
+	app = configure(primary, DATABASE_REPLICA_URL = replica)
+	client = app.test_client()
+	login(client)
+	yield client
+	main.session.remove()
+
+
+def test_get_requests_read_from_the_replica(client, databases):
+	rooms = client.get("/api/rooms").get_json()['Rooms']
+	assert rooms[0]['name'] == "From replica"
+	assert b"From replica" in client.get("/room/1/items/").data
+
+def test_writes_go_to_the_primary(client, databases):
+	primary, replica = databases
+	response = client.post("/room/add/", data = {'name': "Written"})
+	assert response.status_code == 302
+	assert "Written" in room_names(primary).values()
+	assert "Written" not in room_names(replica).values()
+
+	# The replica has not caught up, so GET pages do not show the room yet
+	assert "Written" not in [room['name'] for room in client.get("/api/rooms").get_json()['Rooms']]
+
+	# POST requests read from the primary, so the new room can be renamed
+	room_id = dict((name, room_id) for room_id, name in room_names(primary).items())["Written"]
+	response = client.post("/room/{}/edit/".format(room_id), data = {'name': "Renamed"})
+	assert response.status_code == 302
+	assert room_names(primary)[room_id] == "Renamed"
+
+def test_primary_db_routes_use_the_primary(client, databases):
+	primary, replica = databases
+	client.post("/room/add/", data = {'name': "Only on primary"})
+	room_id = dict((name, room_id) for room_id, name in room_names(primary).items())["Only on primary"]
+
+	# deleteRoom is a GET route marked @primary_db: it finds the room that
+	# only exists on the primary and deletes it there
+	response = client.get("/room/{}/delete/?delete=true".format(room_id))
+	assert response.status_code == 302
+	assert room_id not in room_names(primary)
+
+	# A plain GET route reads from the replica, where the room never existed
+	client.post("/room/add/", data = {'name': "Another"})
+	room_id = dict((name, room_id) for room_id, name in room_names(primary).items())["Another"]
+	assert b"No room found" in client.get("/room/{}/items/".format(room_id)).data
+
+def test_replica_connections_refuse_writes(client):
+	with pytest.raises(OperationalError):
+		with main.replica_engine.begin() as connection:
+			connection.execute(text("UPDATE room SET name = 'x'"))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+# export_rooms() reads rooms and items with two SELECTs, which may see
+# different snapshots: a room committed in between must not break /JSON.
+
+from sqlalchemy import text
+
+from db import create_db_engine
+import serialization
+
+
+def test_export_skips_items_of_rooms_added_between_queries(client, database, monkeypatch):
+	room_rows = serialization.room_rows
+	written = []
+
+	def room_rows_then_write(connection, owner_id):
+		# Another request commits a room with an item after the rooms are read
+		rows = room_rows(connection, owner_id)
+		engine = create_db_engine(database)
+		with engine.begin() as other:
+			written.append("Late {}".format(len(written) + 1))
+			room_id = other.execute(text("INSERT INTO room(name, user_id) VALUES (:name, :owner_id)"),
+				{'name': written[-1], 'owner_id': owner_id}).lastrowid
+			other.execute(text("INSERT INTO item(name, room_id, user_id) VALUES (:name, :room_id, :owner_id)"),
+				{'name': written[-1] + " item", 'room_id': room_id, 'owner_id': owner_id})
+		engine.dispose()
+		return rows
+
+	monkeypatch.setattr(serialization, "room_rows", room_rows_then_write)
+	for layout in ("nested", "columnar"):
+		response = client.get("/JSON?format={}".format(layout))
+		assert response.status_code == 200
+		assert written[-1].encode() not in response.data
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+
+# WSGI entry point for production servers. Run it from this directory, e.g.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#   waitress-serve --threads 8 --port 5000 wsgi:app
+# Settings come from environment variables or APP_SETTINGS (see config.py).
+
+from main import create_app
+
+app = create_app()